@@ -0,0 +1,305 @@
+# Add parent folder to allow import of shared modules
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import tempfile
+import time
+import tracemalloc
+import requests
+from mock_slope_server import MockServerConfig, serve
+from Shared.projection_watcher import ProjectionWatcher
+from Shared.sigma_report import SigmaReport, SigmaReportParams
+from Shared.slope_api import SlopeApi
+
+# Benchmarks SlopeApi, SigmaReport and the VM-20 and SBA solvers against a local stand-in for the SLOPE API
+# The sba_scenarios scenario also checks the SBA scenario generator against the rates in SBA Scenario Generator.xlsx
+# The mock server runs in its own process so its work does not count towards the client's timing or memory use.
+# For each scenario this reports wall clock time, HTTP calls made by the client, calls seen by the server and the
+# peak memory allocated by Python while the scenario ran.
+#
+# Example:  python main.py --latency 0.05 --report-rows 500000 --max-concurrent-segments 4 --rate-limit 50
+
+scenarios = ["data_table", "upload", "report", "projections", "vm20", "sba", "sba_scenarios"]
+
+# Report name -> kind of data the mock server returns for it, for each solver's reports.json
+vm20_report_kinds = {"Starting Assets": "starting_assets", "Scenario Reserves": "scenario_reserves", "Liability Cash Flows": "liability_cash_flows"}
+sba_report_kinds = {"Liability Cash Flows": "sba_liability_cash_flows", "Market Value Liability": "market_value_liability",
+                    "Asset Products": "asset_products", "Asset MPF": "asset_mpf", "Scenario Data": "scenario_data",
+                    "Solver Results": "sba_solver_results"}
+
+sba_scenario_tolerance = 1e-10     # Largest difference allowed between the generated SBA scenario rates and the workbook
+
+
+def setup_logging(level):
+    log_formatter = logging.Formatter("%(asctime)s [%(threadName)-12.12s] [%(levelname)-5.5s]  %(message)s")
+    root_logger = logging.getLogger()
+    root_logger.setLevel(level)
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(log_formatter)
+    root_logger.addHandler(console_handler)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the SLOPE API client against a local mock server")
+    parser.add_argument("--scenarios", nargs="+", choices=scenarios, default=scenarios)
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds added to every mock server request")
+    parser.add_argument("--generation-delay", type=float, default=1.0, help="Seconds each report takes to generate")
+    parser.add_argument("--projection-runtime", type=float, default=3.0, help="Seconds each projection runs for")
+    parser.add_argument("--rate-limit", type=float, default=0, help="Requests per second before the server returns 429s (0 = no limit)")
+    parser.add_argument("--transfer-error-rate", type=float, default=0, help="Fraction of uploads and downloads that fail with a 503")
+    parser.add_argument("--data-table-rows", type=int, default=50000)
+    parser.add_argument("--data-table-page-size", type=int, default=10000)
+    parser.add_argument("--report-rows", type=int, default=200000)
+    parser.add_argument("--report-row-padding", type=int, default=0, help="Extra characters per report row, to increase payload size")
+    parser.add_argument("--row-batch-size", type=int, default=50000, help="Rows per report segment")
+    parser.add_argument("--max-concurrent-segments", type=int, default=4)
+    parser.add_argument("--storage-format", choices=["csv", "parquet", "feather"], default="csv", help="Storage format of the downloaded report (columnar formats need pyarrow)")
+    parser.add_argument("--compression", choices=["gzip", "zstd"], help="Store the downloaded report compressed (zstd needs zstandard)")
+    parser.add_argument("--compress-transfers", action="store_true", help="Have the server gzip report downloads")
+    parser.add_argument("--upload-mb", type=int, default=50)
+    parser.add_argument("--projections", type=int, default=10, help="Number of projections run at the same time")
+    parser.add_argument("--scenario-count", type=int, default=100, help="Scenarios in the VM-20 reports")
+    parser.add_argument("--pivot-times", type=int, default=8, help="Pivot times solved by the SBA solver and in the SBA scenario generation")
+    parser.add_argument("--asset-model-points", type=int, default=1000, help="Model points per asset product and pivot time in the SBA Asset MPF report")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="Minimum projection status poll interval in seconds")
+    parser.add_argument("--output", help="Optional JSON file to write the results to")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args()
+
+
+def find_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(config: MockServerConfig) -> multiprocessing.Process:
+    process = multiprocessing.Process(target=serve, args=(config,), daemon=True)
+    process.start()
+    for _ in range(100):
+        try:
+            with socket.create_connection(("127.0.0.1", config.port), timeout=0.1):
+                return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Mock SLOPE server did not start.")
+
+
+def server_request_count(server_url: str) -> int:
+    return requests.get(f"{server_url}/_stats").json()["requests"]
+
+
+def client_request_count(api: SlopeApi) -> int:
+    return sum(endpoint["count"] for endpoint in api.metrics.get_summary().values())
+
+
+# Load a solver's report definitions and map each report element to the kind of data the mock server returns for it
+def solver_reports(solver_folder: str, kinds: dict, working_directory: str) -> tuple[dict, dict]:
+    with open(Path(__file__).resolve().parent.parent / solver_folder / "reports.json", "r") as file:
+        reports_json = json.load(file)
+    reports = {}
+    for key, value in reports_json.items():
+        report = SigmaReportParams.from_dict(value)
+        report.working_directory = working_directory
+        reports[key] = report
+
+    report_kinds = {reports[key].element_id: kind for key, kind in kinds.items() if key in reports}
+    return reports, report_kinds
+
+
+# Pivot times solved by the SBA solver, one a year
+def sba_pivot_times(args) -> list[int]:
+    return [12 * year for year in range(1, args.pivot_times + 1)]
+
+
+def run_data_table(api: SlopeApi, args, working_directory: str):
+    table = api.get_data_table_by_id(1)
+    return f"{len(table)} rows"
+
+
+def run_upload(api: SlopeApi, args, working_directory: str):
+    filename = os.path.join(working_directory, "upload.csv")
+    line = b"1,2,3,4,5,6,7,8,9,10,Benchmark Upload Row\n"
+    block = line * (1048576 // len(line))
+    with open(filename, "wb") as file:
+        for _ in range(args.upload_mb):
+            file.write(block)
+    api.upload_file(filename, "Benchmark/upload.csv")
+    return f"{os.path.getsize(filename) / 1048576:.0f} MB"
+
+
+def run_report(api: SlopeApi, args, working_directory: str):
+    params = SigmaReportParams("BenchmarkWorkbook", "BenchmarkElement", {"Projection-ID": "Projection-ID"},
+                               working_directory=working_directory, row_batch_size=args.row_batch_size,
+                               max_concurrent_segments=args.max_concurrent_segments, cache=False,
+                               storage_format=args.storage_format, compression=args.compression)
+    report = SigmaReport(api, params)
+    report.retrieve({"Projection-ID": "1"})
+    report.get_data()
+    detail = f"{report.get_row_count()} rows, {len(report.segments)} segments, {report.get_byte_count() / 1048576:.1f} MB ({os.path.getsize(report.get_filename()) / 1048576:.1f} MB on disk)"
+    report.cleanup()
+    return detail
+
+
+def run_projections(api: SlopeApi, args, working_directory: str):
+    projection_ids = [api.copy_projection(1, f"Benchmark {i}") for i in range(args.projections)]
+    for projection_id in projection_ids:
+        api.update_projection(projection_id, {"scenarioSubset": ""})
+        api.run_projection(projection_id)
+    futures = [api.projection_watcher.watch(projection_id) for projection_id in projection_ids]
+    for future in futures:
+        future.result()
+    return f"{len(projection_ids)} projections"
+
+
+def run_vm20(api: SlopeApi, args, working_directory: str, reports: dict, clients: list[SlopeApi]):
+    sys.path.append(str(Path(__file__).resolve().parent.parent / "PBR_Solver"))
+    from vm20 import VM20, VM20Params
+
+    params = VM20Params(
+        api_key="benchmark",
+        api_secret="benchmark",
+        scenario_sample_size=0.10,
+        min_scenarios=8,
+        max_iterations=5,
+        pbr_projection_template_name="VM-20 Asset Collar Solver Template",
+        reports=reports,
+        working_directory=working_directory
+    )
+    solver = VM20(params)
+    # The solver uses its own API instance - include its calls in the client counts
+    clients.append(solver.api)
+    try:
+        assets, projection_id = solver.solve_asset_collar(1)
+    finally:
+        solver.api.close()
+    return f"assets {assets:,.0f}"
+
+
+# Solve the BEL at args.pivot_times pivot times, which pulls the pivot point reports, uploads the asset model points
+# and SBA scenarios and runs the guess projections of every time point
+def run_sba(api: SlopeApi, args, working_directory: str, reports: dict, clients: list[SlopeApi]):
+    sys.path.append(str(Path(__file__).resolve().parent.parent / "SBA_Solver"))
+    import settings
+    from sba_solver import SbaSolver
+
+    settings.solver_folder = f"{working_directory}\\SBA Solver"
+    settings.report_cache_folder = f"{settings.solver_folder}\\Report Cache\\"
+    settings.metadata_cache_file = None
+    settings.api_key = settings.api_secret = "benchmark"
+
+    solver = SbaSolver(1, reports)
+    # The solver uses its own API instance - include its calls in the client counts
+    clients.append(solver.api)
+    try:
+        solver.calculate_bel(sba_pivot_times(args))
+    finally:
+        solver.api.close()
+    return f"{len(solver.final_bel)} pivot times solved"
+
+
+# Check the NumPy SBA scenario generator against the rates last calculated by Excel in SBA Scenario Generator.xlsx,
+# then time generating scenarios for args.pivot_times pivot times in one batch
+def run_sba_scenarios(api: SlopeApi, args, working_directory: str):
+    sba_folder = Path(__file__).resolve().parent.parent / "SBA_Solver"
+    sys.path.append(str(sba_folder))
+    import numpy as np
+    import sba_scenarios
+
+    difference = sba_scenarios.validate_against_workbook(str(sba_folder / "SBA Scenario Generator.xlsx"))
+    if difference > sba_scenario_tolerance:
+        raise AssertionError(f"Generated SBA scenarios differ from the workbook by {difference:.3e} (tolerance {sba_scenario_tolerance:.0e}).")
+
+    spot_curves = 0.03 + 0.01 * np.log1p(np.arange(1, sba_scenarios.max_tenor + 1))[None, :] * np.linspace(0.5, 1.5, args.pivot_times)[:, None]
+    sba_scenarios.generate_scenarios(spot_curves)
+    return f"max difference from workbook {difference:.1e}, {args.pivot_times} pivot times"
+
+
+def run_benchmark(args) -> list[dict]:
+    # Work in a temporary directory. The solvers build Windows style paths, so everything is kept relative to it.
+    os.chdir(tempfile.mkdtemp(prefix="slope_benchmark_"))
+    working_directory = "."
+    reports, report_kinds = solver_reports("PBR_Solver", vm20_report_kinds, working_directory)
+    sba_reports, sba_kinds = solver_reports("SBA_Solver", sba_report_kinds, working_directory)
+
+    config = MockServerConfig(
+        port=find_free_port(),
+        latency=args.latency,
+        generation_delay=args.generation_delay,
+        projection_runtime=args.projection_runtime,
+        rate_limit=args.rate_limit,
+        transfer_error_rate=args.transfer_error_rate,
+        compress_transfers=args.compress_transfers,
+        data_table_rows=args.data_table_rows,
+        data_table_page_size=args.data_table_page_size,
+        report_rows=args.report_rows,
+        report_row_padding=args.report_row_padding,
+        scenario_count=args.scenario_count,
+        pivot_times=sba_pivot_times(args),
+        asset_model_points=args.asset_model_points,
+        report_kinds={**report_kinds, **sba_kinds}
+    )
+    process = start_server(config)
+    server_url = f"http://127.0.0.1:{config.port}"
+
+    SlopeApi.api_url = f"{server_url}/api/v1"
+    ProjectionWatcher.min_poll_interval = args.poll_interval
+
+    results = []
+    api = SlopeApi()
+    try:
+        api.authorize("benchmark", "benchmark")
+        for scenario in args.scenarios:
+            logging.info(f"Running benchmark scenario '{scenario}'")
+            clients = [api]
+            client_before = client_request_count(api)
+            server_before = server_request_count(server_url)
+            tracemalloc.start()
+            start = time.perf_counter()
+
+            if scenario == "vm20":
+                detail = run_vm20(api, args, working_directory, reports, clients)
+            elif scenario == "sba":
+                detail = run_sba(api, args, working_directory, sba_reports, clients)
+            else:
+                detail = globals()[f"run_{scenario}"](api, args, working_directory)
+
+            seconds = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results.append({
+                "scenario": scenario,
+                "seconds": seconds,
+                "client_requests": sum(client_request_count(client) for client in clients) - client_before,
+                "server_requests": server_request_count(server_url) - server_before,
+                "peak_memory_mb": peak / 1048576,
+                "detail": detail
+            })
+    finally:
+        api.close()
+        process.terminate()
+
+    return results
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    setup_logging(logging.INFO if args.verbose else logging.WARNING)
+
+    results = run_benchmark(args)
+
+    print(f"{'Scenario':<14}{'Seconds':>10}{'Client Calls':>14}{'Server Calls':>14}{'Peak MB':>10}  Detail")
+    for result in results:
+        print(f"{result['scenario']:<14}{result['seconds']:>10.2f}{result['client_requests']:>14}{result['server_requests']:>14}{result['peak_memory_mb']:>10.1f}  {result['detail']}")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=4)
@@ -0,0 +1,418 @@
+# Local stand-in for the SLOPE API used to benchmark SlopeApi, SigmaReport and the solvers without running real projections
+# Implements the endpoints used by the Shared client, plus presigned style upload/download URLs served from the same host.
+# Latency, report generation time, projection run time, rate limits and payload sizes are all configurable.
+# Can be run on its own:  python mock_slope_server.py --port 8765 --latency 0.05
+import argparse
+import csv
+import datetime
+import io
+import gzip
+import hashlib
+import itertools
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field, asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+
+@dataclass
+class MockServerConfig:
+    port: int = 8765
+    latency: float = 0.02                   # Seconds added to every request
+    generation_delay: float = 1.0           # Seconds a workbook report takes to generate
+    projection_runtime: float = 5.0         # Seconds a projection runs for
+    rate_limit: float = 0                   # Maximum requests per second before 429s are returned (0 = no limit)
+    transfer_error_rate: float = 0          # Fraction of upload/download requests that fail with a 503
+    compress_transfers: bool = False        # gzip report downloads for clients that accept it
+    data_table_rows: int = 50000            # Rows in every data table
+    data_table_page_size: int = 10000       # Rows returned per data table page
+    report_rows: int = 100000               # Rows in the generic benchmark report
+    report_row_padding: int = 0             # Extra characters added to each generic report row to control payload size
+    scenario_count: int = 100               # Number of scenarios in the VM-20 style reports
+    cash_flow_months: int = 120             # Months of cash flows per scenario in the liability cash flow report
+    pivot_times: list = field(default_factory=lambda: [12, 24, 36, 48])   # Pivot times in the SBA pivot point reports
+    asset_products: int = 5                 # Asset products in the SBA Asset Products and Asset MPF reports
+    asset_model_points: int = 1000          # Model points per asset product and pivot time in the SBA Asset MPF report
+    liability_market_value: float = 100000000.0   # Market value of liabilities at every SBA pivot time
+    # Report element ID -> report kind ("benchmark", "starting_assets", "scenario_reserves", "liability_cash_flows",
+    # "sba_liability_cash_flows", "market_value_liability", "asset_products", "asset_mpf", "scenario_data", "sba_solver_results")
+    report_kinds: dict = field(default_factory=dict)
+
+
+class MockSlopeState:
+    def __init__(self, config: MockServerConfig):
+        self.config = config
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1000)
+        self.projections = {}
+        self.generations = {}
+        self.uploads = {}
+        self.upload_paths = {}      # Upload key -> SLOPE file path
+        self.files = {}             # SLOPE file path -> content, for files small enough to keep
+        self.data_tables = {}       # Data table ID -> SLOPE file path it was loaded from
+        self.request_counts = {}
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.rate_limited = 0
+        self.__tokens = config.rate_limit
+        self.__last_refill = time.time()
+
+    def next_id(self) -> int:
+        with self.lock:
+            return next(self.ids)
+
+    # Token bucket rate limiter - returns False if this request should get a 429
+    def allow_request(self) -> bool:
+        if self.config.rate_limit <= 0:
+            return True
+        with self.lock:
+            now = time.time()
+            self.__tokens = min(self.config.rate_limit, self.__tokens + (now - self.__last_refill) * self.config.rate_limit)
+            self.__last_refill = now
+            if self.__tokens < 1:
+                self.rate_limited += 1
+                return False
+            self.__tokens -= 1
+            return True
+
+    def count(self, key: str, bytes_received: int, bytes_sent: int):
+        with self.lock:
+            self.request_counts[key] = self.request_counts.get(key, 0) + 1
+            self.bytes_received += bytes_received
+            self.bytes_sent += bytes_sent
+
+    # Starting assets of each scenario in the Initial Asset Scaling table set on a projection: {scenario: starting assets}
+    def projection_starting_assets(self, projection_id: int) -> dict:
+        with self.lock:
+            table_id = self.projections.get(projection_id, {}).get("dataTables", {}).get("Initial Asset Scaling")
+            content = self.files.get(self.data_tables.get(table_id))
+        if content is None:
+            return {}
+        rows = csv.DictReader(io.StringIO(content.decode("utf-8")))
+        return {int(row["Scenario #"]): float(row["Scaling Target"]) for row in rows}
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "requests": sum(self.request_counts.values()),
+                "request_counts": dict(self.request_counts),
+                "bytes_received": self.bytes_received,
+                "bytes_sent": self.bytes_sent,
+                "rate_limited": self.rate_limited
+            }
+
+
+small_file_limit = 1048576     # Uploaded files up to this size are kept, so the solver inputs they hold can be read back
+
+
+# Values of a comma separated report filter, or all of the values when the filter is not set
+def filter_values(parameters: dict, name: str, values: list) -> list:
+    selected = [value.strip() for value in str(parameters.get(name, "")).split(",") if value.strip()]
+    return [value for value in values if str(value) in selected] if selected else values
+
+
+# Date that is months after the start of the base projection
+def pivot_date(months: int) -> str:
+    return datetime.date(2025 + months // 12, months % 12 + 1, 1).isoformat()
+
+
+# CSV content of each kind of report, returned as (header, rows) for the rows between offset and offset + limit
+# The SBA pivot point reports have a Pivot Time Index column and return every pivot time unless the Pivot-Time-Index filter is set
+def build_report(config: MockServerConfig, kind: str, parameters: dict, offset: int, limit: int, state: 'MockSlopeState' = None):
+    pivot_times = filter_values(parameters, "Pivot-Time-Index", config.pivot_times)
+    products = filter_values(parameters, "Product-Name", [f"Asset Product {product}" for product in range(1, config.asset_products + 1)])
+    if kind == "sba_liability_cash_flows":
+        header = ["Time Index", "Policy Group", "Liability Cash Flow"]
+        rows = ([month, "All", 1000000.0] for month in range(1, config.cash_flow_months + 1))
+    elif kind == "market_value_liability":
+        header = ["Date", "Market Value", "Pivot Time Index"]
+        rows = [[pivot_date(time), config.liability_market_value, time] for time in pivot_times]
+    elif kind == "asset_products":
+        header = ["Product Name", "Market Value at Pivot Time", "Pivot Time Index"]
+        rows = [[product, config.liability_market_value / config.asset_products, time] for time in pivot_times for product in products]
+    elif kind == "asset_mpf":
+        header = ["Product Name", "Model Point", "Par Value", "Coupon", "Maturity Month", "Pivot Time Index"]
+        rows = ([product, point, 10000.0, 0.04, 12 + point % 360, time]
+                for time in pivot_times for product in products for point in range(1, config.asset_model_points + 1))
+    elif kind == "scenario_data":
+        header = ["Year", "Spot Rate", "Pivot Time Index"]
+        rows = [[year, 0.03 + 0.005 * math.log1p(year) + 0.0001 * time / 12, time] for time in pivot_times for year in range(1, 101)]
+    elif kind == "sba_solver_results":
+        # Ending assets are the starting assets less a target of up to 8% above the liability market value, so the first guesses miss
+        # and the solver has to interpolate
+        starting_assets = state.projection_starting_assets(int(parameters.get("Projection-ID", 0))) if state is not None else {}
+        header = ["Scenario Number", "Starting Assets", "Ending Assets"]
+        rows = [[scenario, assets, assets - config.liability_market_value * (1 + 0.02 * (scenario % 5))]
+                for scenario, assets in sorted(starting_assets.items())]
+    elif kind == "starting_assets":
+        header, rows = ["Starting Assets"], [[1000000.0]]
+    elif kind == "scenario_reserves":
+        header = ["Scenario Number", "Scenario Reserve"]
+        rows = [[scenario, 1050000.0 + 1000.0 * ((scenario * 37) % 100)] for scenario in range(1, config.scenario_count + 1)]
+    elif kind == "liability_cash_flows":
+        scenarios = [int(scenario) for scenario in str(parameters.get("Scenario-Number", "")).split(",") if scenario.strip().isdigit()]
+        if len(scenarios) == 0:
+            scenarios = list(range(1, config.scenario_count + 1))
+        header = ["Scenario Number", "Time Index", "Policy Group", "Benefit Cash Flow", "Premium Cash Flow"]
+        rows = ([scenario, month, "All", 1000.0 + month, 250.0]
+                for scenario in scenarios for month in range(1, config.cash_flow_months + 1))
+    else:
+        padding = "x" * config.report_row_padding
+        header = ["Row", "Scenario Number", "Time Index", "Value", "Padding"]
+        rows = ([row, row % 1000, row % 600, row * 0.5, padding] for row in range(config.report_rows))
+
+    end = offset + limit if limit else None
+    return header, list(itertools.islice(rows, offset, end))
+
+
+def to_csv(header: list, rows: list) -> bytes:
+    lines = [",".join(str(value) for value in header)]
+    lines += [",".join(str(value) for value in row) for row in rows]
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class MockSlopeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: MockSlopeState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.__handle("GET")
+
+    def do_POST(self):
+        self.__handle("POST")
+
+    def do_PUT(self):
+        self.__handle("PUT")
+
+    def do_PATCH(self):
+        self.__handle("PATCH")
+
+    def __read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length > 0 else b""
+
+    def __send(self, status: int, body: bytes = b"", content_type: str = "application/json", headers: dict = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+        return len(body)
+
+    def __send_json(self, value, status: int = 200):
+        return self.__send(status, json.dumps(value).encode("utf-8"))
+
+    def __handle(self, method: str):
+        state = self.state
+        config = state.config
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        path = url.path.rstrip("/")
+        body = self.__read_body()
+
+        if path == "/_stats":
+            self.__send_json(state.get_stats())
+            return
+
+        if not state.allow_request():
+            state.count("429", len(body), 0)
+            self.__send(429, b'{"message": "Too many requests"}', headers={"Retry-After": "1"})
+            return
+
+        time.sleep(config.latency)
+        parts = path.split("/")
+        route = f"{method} " + "/".join("{id}" if part.isdigit() or len(part) >= 20 else part for part in parts)
+        try:
+            sent = self.__route(method, parts, query, body)
+        except KeyError as e:
+            sent = self.__send_json({"message": f"Not found: {e}"}, 404)
+        state.count(route, len(body), sent)
+
+    def __route(self, method: str, parts: list, query: dict, body: bytes) -> int:
+        state = self.state
+        config = state.config
+        request = json.loads(body) if body and self.headers.get("Content-Type", "").startswith("application/json") else {}
+        host = f"http://{self.headers.get('Host')}"
+
+        # Presigned style object store URLs
+        if parts[1] == "storage":
+            if random.random() < config.transfer_error_rate:
+                return self.__send(503, b"Slow Down", "text/plain")
+            if method == "PUT":
+                digest = hashlib.md5(body).hexdigest()
+                with state.lock:
+                    state.uploads[parts[-1]] = len(body)
+                    if len(body) <= small_file_limit and parts[-1] in state.upload_paths:
+                        state.files[state.upload_paths[parts[-1]]] = body
+                return self.__send(200, b"", headers={"ETag": f'"{digest}"'})
+            generation = state.generations[parts[-1]]
+            header, rows = build_report(config, generation["kind"], generation["parameters"], generation["offset"], generation["rowLimit"], state)
+            content = to_csv(header, rows)
+            headers = {"ETag": f'"{hashlib.md5(content).hexdigest()}"'}
+            if config.compress_transfers and "gzip" in self.headers.get("Accept-Encoding", ""):
+                content = gzip.compress(content, compresslevel=6)
+                headers["Content-Encoding"] = "gzip"
+            return self.__send(200, content, "text/csv", headers)
+
+        endpoint = "/".join(parts[3:])
+        now = datetime.datetime.now(datetime.timezone.utc)
+
+        if endpoint in ("Authorize", "Authorize/Refresh"):
+            return self.__send_json({"accessToken": uuid.uuid4().hex, "refreshToken": uuid.uuid4().hex,
+                                     "expires": (now + datetime.timedelta(minutes=10)).isoformat()})
+
+        if endpoint == "Files/GetUploadUrl":
+            upload_key = uuid.uuid4().hex
+            with state.lock:
+                state.upload_paths[upload_key] = request.get("filePath")
+            return self.__send_json({"uploadUrl": f"{host}/storage/uploads/{upload_key}"})
+        if endpoint == "Files/SaveUpload":
+            return self.__send_json({"fileId": state.next_id()})
+
+        if endpoint == "DataTables/Data":
+            offset = int(query.get("Offset", 0))
+            end = min(offset + config.data_table_page_size, config.data_table_rows)
+            rows = [[row % 1000, row % 600, f"Product {row % 20}", row * 0.25, row % 2 == 0] for row in range(offset, end)]
+            return self.__send_json({
+                "id": int(query.get("DataTableId", 1)),
+                "name": query.get("Name", "Benchmark Table"),
+                "columns": [
+                    {"name": "Scenario Number", "dataType": "Integer", "isIndex": True},
+                    {"name": "Time Index", "dataType": "Integer", "isIndex": True},
+                    {"name": "Product", "dataType": "Text", "isIndex": False},
+                    {"name": "Value", "dataType": "Decimal", "isIndex": False},
+                    {"name": "Flag", "dataType": "Boolean", "isIndex": False}
+                ],
+                "rows": rows,
+                "offset": end if end < config.data_table_rows else None
+            })
+        if parts[3] in ("DataTables", "ScenarioTables", "DecrementTables"):
+            table_id = state.next_id()
+            if parts[3] == "DataTables":
+                with state.lock:
+                    state.data_tables[table_id] = request.get("filePath")
+            return self.__send_json({"id": table_id})
+
+        if parts[3] == "TableStructures":
+            if parts[4] == "List":
+                return self.__send_json([{"id": 11, "name": "EPL Inputs"}, {"id": 12, "name": "Initial Asset Scaling"}])
+            return self.__send_json({"items": [{"name": name} for name in ["Liability ID", "Scenario Number", "Time Index", "Benefit Cash Flow", "Premium Cash Flow", "Expense Cash Flow"]]})
+
+        if parts[3] == "Models":
+            if parts[5] == "ProjectionTemplates":
+                return self.__send_json({"items": [{"id": 21, "name": "VM-20 Asset Collar Solver Template"}, {"id": 22, "name": "SBA Solver Template"}]})
+            return self.__send_json({"items": []})
+
+        if parts[3] == "Projections":
+            return self.__route_projection(method, parts, query, request)
+
+        if endpoint.startswith("Reports/Workbooks/Status/"):
+            generation = state.generations[parts[-1]]
+            if time.time() - generation["created"] < config.generation_delay:
+                return self.__send_json({"status": "InProgress"})
+            return self.__send_json({"status": "Completed", "downloadUrl": f"{host}/storage/reports/{parts[-1]}"})
+        if endpoint.startswith("Reports/Workbooks/") and parts[-1] == "Generate":
+            generation_id = uuid.uuid4().hex
+            with state.lock:
+                state.generations[generation_id] = {
+                    "created": time.time(),
+                    "kind": config.report_kinds.get(request.get("elementId"), "benchmark"),
+                    "parameters": request.get("parameters", {}),
+                    "offset": int(request.get("offset") or 0),
+                    "rowLimit": int(request.get("rowLimit") or 0)
+                }
+            return self.__send_json({"generationId": generation_id})
+
+        raise KeyError(endpoint)
+
+    def __route_projection(self, method: str, parts: list, query: dict, request: dict) -> int:
+        state = self.state
+        if len(parts) == 4:
+            projection_id = state.next_id()
+            with state.lock:
+                state.projections[projection_id] = {"started": None}
+            return self.__send_json({"id": projection_id})
+
+        projection_id = int(parts[4])
+        with state.lock:
+            projection = state.projections.setdefault(projection_id, {"started": time.time() - state.config.projection_runtime})
+
+        if len(parts) > 5 and parts[5] == "Copy":
+            new_id = state.next_id()
+            with state.lock:
+                state.projections[new_id] = {"started": None}
+            return self.__send_json({"id": new_id})
+        if len(parts) > 5 and parts[5].lower() == "run":
+            projection["started"] = time.time()
+            return self.__send(200)
+        if method == "PATCH":
+            with state.lock:
+                for table in request.get("dataTables", []):
+                    projection.setdefault("dataTables", {})[table.get("tableStructureName")] = table.get("dataTableId")
+            return self.__send(200)
+
+        is_running = projection["started"] is not None and time.time() - projection["started"] < state.config.projection_runtime
+        details = {
+            "id": projection_id,
+            "status": "Running" if is_running else ("Completed" if projection["started"] is not None else "NotStarted"),
+            "isRunning": is_running,
+            "model": {"id": 1},
+            "startDate": "2025-01-01T00:00:00",
+            "periodInMonths": state.config.cash_flow_months,
+            "scenarioTableId": 31,
+            "portfolios": [{"products": []}]
+        }
+        if "fields" in query:
+            details = {key: details[key] for key in query["fields"].split(",") if key in details}
+        return self.__send_json(details)
+
+
+# Runs the mock server on a background thread
+class MockSlopeServer:
+    def __init__(self, config: MockServerConfig):
+        self.config = config
+        self.state = MockSlopeState(config)
+        handler = type("Handler", (MockSlopeHandler,), {"state": self.state})
+        self.server = ThreadingHTTPServer(("127.0.0.1", config.port), handler)
+        self.server.daemon_threads = True
+        self.__thread = None
+
+    @property
+    def api_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/api/v1"
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.server.serve_forever, name="MockSlopeServer", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# Entry point used to run the server in its own process, so it does not affect the client's timing or memory use
+def serve(config: MockServerConfig):
+    server = MockSlopeServer(config)
+    server.server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the SLOPE API")
+    defaults = MockServerConfig()
+    for name, value in asdict(defaults).items():
+        if isinstance(value, bool):
+            parser.add_argument(f"--{name.replace('_', '-')}", action="store_true")
+        elif isinstance(value, (int, float)):
+            parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value)
+    args = parser.parse_args()
+    serve(MockServerConfig(**vars(args)))
@@ -2,8 +2,10 @@ import csv
 import logging
 import math
 import os
+import pandas as pd
 import time
 from guess_iteration import GuessIteration
+from Shared.report_cache import ReportCache
 from Shared.sigma_report import SigmaReport
 from Shared.slope_api import SlopeApi
 from vm20_params import VM20Params, VM20RestartParams
@@ -26,11 +28,12 @@ class VM20:
     __solver_steps: list[dict] = None
 
     def __init__(self, params: VM20Params):
-        self.api = SlopeApi()
+        self.api = SlopeApi(metadata_cache_file=f'{params.working_directory}\\metadata_cache.json')
         if params.api_key and params.api_secret:
             self.api.authorize(params.api_key, params.api_secret)
         
         self.params = params
+        self.report_cache = ReportCache(f'{params.working_directory}\\Report Cache', params.report_cache_max_bytes)
 
     # Solves for the value of starting assets such that the assets are within 2% of the final reserve value
     # Returns a tuple of (assets, projection_id)
@@ -67,7 +70,7 @@ class VM20:
             else:
                 # Calculate Scenario Reserves for base projection
                 logging.info("Asset Collar Solver: Checking Starting Run Tolerance.")
-                stochastic_reserve = self.__get_stochastic_reserve(sr_projection_id, full_scenario_set=True)
+                stochastic_reserve = self.__get_stochastic_reserve(sr_projection_id, full_scenario_set=True, use_cache=True)
                 diff = stochastic_reserve - starting_assets
                 if abs(diff) <= self.asset_collar_tolerance * starting_assets:
                     # Initial Run is within tolerance - we are done
@@ -108,7 +111,7 @@ class VM20:
             logging.info("Asset Collar Solver: Running Full Stochastic Scenario Set with original liabilities to verify tolerance.")
             stochastic_projection_id = self.__run_stochastic_set(sr_projection_id, f"Projection {sr_projection_id} VM-20 Solver Final", solver_assets)
             self.api.wait_for_completion(stochastic_projection_id)
-            stochastic_reserve = self.__get_stochastic_reserve(stochastic_projection_id, full_scenario_set=True)
+            stochastic_reserve = self.__get_stochastic_reserve(stochastic_projection_id, full_scenario_set=True, use_cache=False)
             diff = stochastic_reserve - solver_assets
             diff_pct = "{:.2%}".format(diff/stochastic_reserve)
             self.__solver_steps.append({"Iteration": "Final Full Stochastic Run",
@@ -122,6 +125,7 @@ class VM20:
 
             for step in self.__solver_steps:
                 logging.info(f"Iteration: {step['Iteration']}, Guess: {step['Guess']}, Difference: {step['Difference']}, DifferencePct: {step['DifferencePct']}")
+            logging.info(f"Report cache statistics: {self.report_cache.get_statistics()}")
 
             return solver_assets, stochastic_projection_id
             
@@ -136,6 +140,12 @@ class VM20:
             else:
                 logging.info(f"initial_guesses={self.restart_params.initial_guesses}")
             raise
+        finally:
+            self.__export_api_metrics(sr_projection_id)
+
+    # Write the API call statistics for this solver run to the working directory
+    def __export_api_metrics(self, sr_projection_id):
+        self.api.metrics.export(f'{self.params.working_directory}\\Projection-{sr_projection_id} API Metrics')
     
     def __create_starting_asset_table(self, starting_assets, guess_num: int):
         
@@ -166,10 +176,11 @@ class VM20:
     
     def __get_cte_scenarios(self, projection_id: int) -> list[int]:
         # Download SR by Scenario
-        report = SigmaReport(self.api, self.params.reports.get("Scenario Reserves"))
+        report = SigmaReport(self.api, self.params.reports.get("Scenario Reserves"), cache=self.report_cache)
         report.retrieve({"Projection-ID": str(projection_id)})
         
         scenario_values = report.get_data()
+        report.cleanup()
         if scenario_values.empty:
             raise ValueError("No scenarios found in the report.")
         
@@ -186,56 +197,62 @@ class VM20:
         self.base_projection_details = self.api.get_projection_details(projection_id)
         self.model_id = self.base_projection_details.get('model').get('id')
 
-        templates = self.api.list_projection_templates(self.model_id)
-        self.__pbr_projection_template_id = next((template['id'] for template in templates if template['name'] == self.params.pbr_projection_template_name), None)
+        self.__pbr_projection_template_id = self.api.get_projection_template_id(self.model_id, self.params.pbr_projection_template_name)
 
-        table_structures = self.api.list_table_structures(self.model_id)
-        self.__epl_table_structure_id = next((table['id'] for table in table_structures if table['name'] == self.params.epl_table_structure_name), None)
-        self.__starting_assets_table_structure_id = next((table['id'] for table in table_structures if table['name'] == self.params.starting_assets_table_structure_name), None)  
+        self.__epl_table_structure_id = self.api.get_table_structure_id(self.model_id, self.params.epl_table_structure_name)
+        self.__starting_assets_table_structure_id = self.api.get_table_structure_id(self.model_id, self.params.starting_assets_table_structure_name)
 
     def __get_liability_cashflows(self, projection_id: int, sample_scenarios: list[int]) -> str:
-        report = SigmaReport(self.api, self.params.reports.get("Liability Cash Flows"))
+        report = SigmaReport(self.api, self.params.reports.get("Liability Cash Flows"), cache=self.report_cache)
         report.retrieve({"Projection-ID": str(projection_id), "Scenario": ",".join(map(str, sample_scenarios))})
 
-        # Read cash flows into a dataframe
-        epl_data = report.get_data()
-
         epl_table_columns = self.api.get_table_structure_columns(self.__epl_table_structure_id)
 
-        # Add an empty data row at the bottom to catch any missing months if the cash flows are sparse and populate with 0 cash flows
-        # Note; This assumes there are 3 index columns in the EPL table structure - 
-        # In the futre we should be smarter and check the number of index columns and add the correct number of empty columns
-        index_columns = 3
-        epl_data.loc[epl_data.index.max() + 1] = [""] * index_columns + [0] * (len(epl_data.columns)-index_columns)
-
-        # Add required index columns
-        epl_data["Liability ID"] = "PBR"
-
-        # Add additional columns required by the table structure
-        
-        for column in epl_table_columns:
-            column_name = column["name"]
-            if column_name not in epl_data.columns:
-                epl_data[column_name] = 0
-
-        # Write final updated EPL file to a csv file
-        epl_data.to_csv(report.get_filename(), index=False)
+        def add_epl_columns(epl_data):
+            # Add required index columns
+            epl_data["Liability ID"] = "PBR"
+
+            # Add additional columns required by the table structure
+            for column in epl_table_columns:
+                column_name = column["name"]
+                if column_name not in epl_data.columns:
+                    epl_data[column_name] = 0
+            return epl_data
+
+        # Read the cash flows a batch at a time and write the EPL file as we go, so the whole report is never held in memory
+        epl_filename = f"{self.working_directory}\\Liability Cash Flows.csv"
+        report_columns = report.get_header()
+        with open(epl_filename, 'w', newline='') as epl_file:
+            header = True
+            for epl_data in report.iter_batches():
+                report_columns = list(epl_data.columns)
+                add_epl_columns(epl_data).to_csv(epl_file, index=False, header=header)
+                header = False
+
+            # Add an empty data row at the bottom to catch any missing months if the cash flows are sparse and populate with 0 cash flows
+            # Note; This assumes there are 3 index columns in the EPL table structure - 
+            # In the futre we should be smarter and check the number of index columns and add the correct number of empty columns
+            index_columns = 3
+            empty_row = pd.DataFrame([[""] * index_columns + [0] * (len(report_columns)-index_columns)], columns=report_columns)
+            add_epl_columns(empty_row).to_csv(epl_file, index=False, header=header)
 
         # Upload the EPL cash flows to SLOPE
         logging.info("Create EPL table for liability cash flows for VM-20 Solver runs")
-        epl_table_id = self.api.create_or_update_data_table(report.get_filename(), {
+        epl_table_id = self.api.create_or_update_data_table(epl_filename, {
             "tableStructureId": self.__epl_table_structure_id,
             "name": f"{projection_id} Cash Flows",
             "filePath": f"{self.slope_file_path}/Liability Cash Flows.csv",
             "delimiter": ","
         })
+        report.cleanup()
 
         return epl_table_id
  
     def __get_starting_assets(self, projection_id: int) -> float:
-        report = SigmaReport(self.api, self.params.reports.get("Starting Assets"))
+        report = SigmaReport(self.api, self.params.reports.get("Starting Assets"), cache=self.report_cache)
         report.retrieve({"Projection-ID": str(projection_id)})
         starting_assets_df = report.get_data()
+        report.cleanup()
         if starting_assets_df.empty:
             raise ValueError("No starting assets found in the report.")
 
@@ -254,18 +271,21 @@ class VM20:
 
         return sample_scenarios
 
-    def __get_stochastic_reserve(self, projection_id: int, full_scenario_set: bool) -> float:
+    # use_cache - Set to False for a projection that has just finished, as its results may still be loading into Snowflake
+    def __get_stochastic_reserve(self, projection_id: int, full_scenario_set: bool, use_cache: bool) -> float:
         # Download Scenario Reserves report
-        report = SigmaReport(self.api, self.params.reports.get("Scenario Reserves"))
-        report.retrieve({"Projection-ID": str(projection_id)})
+        report = SigmaReport(self.api, self.params.reports.get("Scenario Reserves"), cache=self.report_cache)
+        report.retrieve({"Projection-ID": str(projection_id)}, use_cache=use_cache)
         
         scenario_values = report.get_data()
+        report.cleanup()
         if scenario_values.empty:
             # Snowflake may have not yet loaded with final results, wait and retry a few times to see
             for attempt in range(5):
                 time.sleep(20)  # Wait 20 seconds before retrying
-                report.retrieve({"Projection-ID": f"{projection_id}"})
+                report.retrieve({"Projection-ID": f"{projection_id}"}, use_cache=use_cache)
                 scenario_values = report.get_data()
+                report.cleanup()
                 if not scenario_values.empty:
                     break
 
@@ -338,7 +358,7 @@ class VM20:
                 # Wait for the projection to complete
                 self.api.wait_for_completion(projection_id)
 
-                stochastic_reserve = self.__get_stochastic_reserve(projection_id, full_scenario_set=False)
+                stochastic_reserve = self.__get_stochastic_reserve(projection_id, full_scenario_set=False, use_cache=False)
                 current_diff = stochastic_reserve - current_guess
                 current_diff_pct = "{:.2%}".format(current_diff/current_guess)
 
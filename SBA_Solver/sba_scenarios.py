@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+
+# Generates the prescribed SBA interest rate scenarios from a risk-free spot curve
+# This reproduces the 'Scenarios' sheet of SBA Scenario Generator.xlsx without Excel:
+# 1. The spot curve (1 to 100 years) is turned into forward spot curves at each future year
+# 2. Each scenario shifts the forward spot curves by short, medium and long term adjustments that are phased in
+#    (and for some scenarios phased out) over a number of years
+# 3. The curves are interpolated between years to the scenario output times and rate tenors
+# Every pivot time is computed in one set of array operations.
+
+max_tenor = 100         # Years in the spot curve
+
+# Prescribed scenario adjustments: 1 year, 10 year and 30 year shifts, phase-in years, phase-out years
+# The phase-in and phase-out are linear. With no phase-out the full adjustment is kept after it has phased in.
+scenario_adjustments = np.array([
+    [0.0, 0.0, 0.0, 0, 0],              # 0 - Base
+    [-0.015, -0.015, -0.015, 10, 0],    # 1
+    [0.015, 0.015, 0.015, 10, 0],       # 2
+    [-0.015, -0.015, -0.015, 5, 5],     # 3
+    [0.015, 0.015, 0.015, 5, 5],        # 4
+    [-0.015, -0.01, -0.005, 10, 0],     # 5
+    [-0.015, -0.01, -0.015, 10, 0],     # 6
+    [0.005, 0.01, 0.015, 10, 0],        # 7
+    [0.015, 0.01, 0.005, 10, 0],        # 8
+])
+
+# Output rate columns and the spot curve tenor (in years) each one is read from
+rate_columns = {"30 Day": 1, "90 Day": 1, "6 Month": 1, "1 Year": 1, "2 Year": 2, "3 year": 3, "4 Year": 4, "5 Year": 5,
+                "6 Year": 6, "7 Year": 7, "8 Year": 8, "9 Year": 9, "10 Year": 10, "20 Year": 20, "30 Year": 30,
+                "40 Year": 40, "50 Year": 50, "60 Year": 60, "70 Year": 70, "80 Year": 80, "90 Year": 90, "100 Year": 100}
+
+# Constant columns of the scenario table
+other_columns = {"Equity": 0.06, "Inflation": 0.0, "Real Estate": 0.0, "Fixed Income": 0.0}
+
+# Output times in months - quarterly for 10 years, then annually to 50 years
+scenario_times = np.concatenate([np.arange(0, 121, 3), np.arange(132, 601, 12)])
+
+
+# Weights of the 1 year, 10 year and 30 year adjustments at each tenor, shape (3, tenors)
+# Short term fades from 1 at 1 year to 0 at 10 years, medium term rises to 1 at 10 years and fades to 0 at 30 years,
+# long term rises from 0 at 10 years to 1 at 30 years.
+def adjustment_weights(tenors: np.ndarray) -> np.ndarray:
+    tenors = np.asarray(tenors, dtype=float)
+    short = np.clip((10 - tenors) / 9, 0, 1)
+    medium = np.where(tenors <= 10, np.clip((tenors - 1) / 9, 0, 1), np.clip((30 - tenors) / 20, 0, 1))
+    long = np.clip((tenors - 10) / 20, 0, 1)
+    return np.stack([short, medium, long])
+
+
+# Proportion of each scenario's adjustment applied at each projection year, shape (scenarios, years)
+def phase_in_factors(years: np.ndarray) -> np.ndarray:
+    years = np.asarray(years, dtype=float)[None, :]
+    phase_in = np.maximum(scenario_adjustments[:, 3:4], 1)
+    phase_out = scenario_adjustments[:, 4:5]
+    phasing_out = np.clip(1 - (years - phase_in) / np.maximum(phase_out, 1), 0, 1)
+    return np.where(years <= phase_in, years / phase_in, np.where(phase_out > 0, phasing_out, 1))
+
+
+# Scenario spot rates for a batch of spot curves
+# spot_curves - shape (pivots, 100), the 1 to 100 year spot rates of each pivot time
+# Returns shape (pivots, scenarios, times, rate columns) for scenario_times and rate_columns
+def generate_scenarios(spot_curves: np.ndarray) -> np.ndarray:
+    spot_curves = np.atleast_2d(np.asarray(spot_curves, dtype=float))
+    if spot_curves.shape[1] != max_tenor:
+        raise ValueError(f"Spot curves must have {max_tenor} rates, not {spot_curves.shape[1]}.")
+
+    # Log of the accumulation factor to each year: cumulative[:, k] = k * log(1 + spot rate for k years)
+    all_tenors = np.arange(1, max_tenor + 1)
+    cumulative = np.zeros((spot_curves.shape[0], max_tenor + 1))
+    cumulative[:, 1:] = all_tenors * np.log1p(spot_curves)
+
+    # Forward spot rate for each tenor starting at each year. Past the end of the curve, the last available
+    # forward rate for that tenor is used.
+    years = np.arange(scenario_times.max() // 12 + 2)
+    tenors = np.array(list(rate_columns.values()))
+    start = np.minimum(years[:, None], max_tenor - tenors[None, :])
+    forward_spots = np.expm1((cumulative[:, start + tenors] - cumulative[:, start]) / tenors)    # (pivots, years, tenors)
+
+    # Shift the curves for each scenario
+    adjustments = scenario_adjustments[:, None, :3] * phase_in_factors(years)[:, :, None]       # (scenarios, years, 3)
+    shifts = adjustments @ adjustment_weights(tenors)                                           # (scenarios, years, tenors)
+    curves = forward_spots[:, None, :, :] + shifts[None, :, :, :]
+
+    # Interpolate between years to the output times
+    year = scenario_times // 12
+    fraction = ((scenario_times % 12) / 12)[:, None]
+    return curves[:, :, year, :] * (1 - fraction) + curves[:, :, year + 1, :] * fraction
+
+
+# The 1 to 100 year spot rates of a pivot time's Scenario Data (year and spot rate columns, one row per year)
+def get_spot_rates(spot_curve: pd.DataFrame) -> np.ndarray:
+    if len(spot_curve) < max_tenor:
+        raise ValueError(f"Spot curve must have {max_tenor} years of rates, but only has {len(spot_curve)}.")
+    return spot_curve.iloc[:max_tenor, 1].to_numpy(dtype=float)
+
+
+# Build scenario tables in the layout of the 'Scenarios' sheet for several pivot times at once
+# spot_curves - {time index: spot curve} as returned by the Scenario Data report
+def generate_scenario_tables(spot_curves: dict[int, pd.DataFrame], currency: str = "USD") -> dict[int, pd.DataFrame]:
+    if len(spot_curves) == 0:
+        return {}
+    time_indexes = list(spot_curves.keys())
+    rates = generate_scenarios(np.stack([get_spot_rates(spot_curves[time_idx]) for time_idx in time_indexes]))
+
+    scenario_count = len(scenario_adjustments)
+    index = pd.DataFrame({"Scenario #": np.repeat(np.arange(scenario_count), len(scenario_times)),
+                          "Time": np.tile(scenario_times, scenario_count),
+                          "Currency": currency})
+    tables = {}
+    for time_idx, pivot_rates in zip(time_indexes, rates):
+        table = pd.DataFrame(pivot_rates.reshape(-1, len(rate_columns)), columns=list(rate_columns.keys()))
+        tables[time_idx] = pd.concat([index, table], axis=1).assign(**other_columns)
+    return tables
+
+
+# Write a scenario table to an Excel file with a single 'Scenarios' sheet, ready to load to SLOPE
+def write_scenario_file(scenarios: pd.DataFrame, filename: str):
+    scenarios.to_excel(filename, sheet_name="Scenarios", index=False)
+
+
+# Compare the generated scenarios with the values last calculated by Excel in the scenario generator workbook
+# Returns the largest absolute difference in any scenario rate
+def validate_against_workbook(workbook_file: str) -> float:
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(workbook_file, read_only=True, data_only=True)
+    try:
+        spot_curve = [row[0] for row in workbook["Input"].iter_rows(min_row=5, max_row=4 + max_tenor, min_col=3, max_col=3, values_only=True)]
+        expected = [row for row in workbook["Scenarios"].iter_rows(min_row=2, min_col=4, max_col=3 + len(rate_columns), values_only=True)]
+    finally:
+        workbook.close()
+
+    actual = generate_scenarios(np.array([spot_curve]))[0].reshape(-1, len(rate_columns))
+    expected = np.array(expected[:len(actual)], dtype=float)
+    if expected.shape != actual.shape:
+        raise ValueError(f"Workbook has {expected.shape[0]} scenario rows, expected {actual.shape[0]}.")
+    return float(np.abs(actual - expected).max())
+
+
+if __name__ == '__main__':
+    import os
+    generator = os.path.join(os.path.dirname(__file__), "SBA Scenario Generator.xlsx")
+    print(f"Maximum difference from '{generator}': {validate_against_workbook(generator):.3e}")
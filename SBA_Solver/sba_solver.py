@@ -1,15 +1,42 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+import csv
 import datetime
 from dataclasses import dataclass
 import pandas as pd
+import io
 import logging
-import openpyxl
-from openpyxl.utils.dataframe import dataframe_to_rows
+import numpy as np
 import os
+import sba_scenarios
 import settings
+import shutil
+from Shared.compressed_files import open_file
+from Shared.report_cache import ReportCache
 from Shared.sigma_report import SigmaReport, SigmaReportParams
 from Shared.slope_api import SlopeApi
+import threading
 import time
-import win32com.client as win32
+
+
+# Limits how many solver projections are running at once across all time points being solved
+# A round of guesses reserves all of its slots in one step, so concurrent time points never each hold part of
+# what they need and wait on each other. Slots are freed as each projection finishes running.
+class ProjectionSlots:
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.__in_use = 0
+        self.__condition = threading.Condition()
+
+    def acquire(self, count: int):
+        count = min(count, self.capacity)
+        with self.__condition:
+            self.__condition.wait_for(lambda: self.__in_use + count <= self.capacity)
+            self.__in_use += count
+
+    def release(self, count: int = 1):
+        with self.__condition:
+            self.__in_use = max(self.__in_use - count, 0)
+            self.__condition.notify_all()
 
 
 class SbaSolver:
@@ -18,11 +45,11 @@ class SbaSolver:
 
     solver_folder = ""
     slope_file_path = ""
-    __asset_market_value = 0
     __base_projection = {}
     __last_cf_time = 0
     __max_iterations = settings.solver_max_iterations
     __tolerance = settings.solver_final_asset_tolerance
+    split_block_size = 67108864     # Bytes of CSV read at a time when splitting a report by a column
 
     @dataclass
     class TimeSolveParams:
@@ -34,8 +61,9 @@ class SbaSolver:
     def __init__(self, projection_id: int, reports: dict[str, SigmaReportParams]):
         self.reports = reports
         self.base_projection_id = projection_id
-        self.api = SlopeApi()
+        self.api = SlopeApi(metadata_cache_file=settings.metadata_cache_file)
         self.api.authorize(settings.api_key, settings.api_secret)
+        self.report_cache = ReportCache(settings.report_cache_folder, settings.report_cache_max_bytes)
         self.solver_folder = f"{settings.solver_folder}\\{projection_id}\\"
         if not os.path.exists(self.solver_folder):
             os.makedirs(self.solver_folder)
@@ -43,6 +71,17 @@ class SbaSolver:
         self.max_error = "Unknown"
         pd.options.display.float_format = '{:,.2f}'.format
 
+        # Every guess round runs 3 projections, so at least 3 must be allowed to run at once
+        self.__projection_slots = ProjectionSlots(max(3, settings.solver_max_projections_in_flight))
+        self.__results_lock = threading.Lock()
+
+        # Pivot point report data split by pivot time: report name -> {time index: data}
+        self.__pivot_data: dict[str, dict[int, pd.DataFrame]] = {}
+        # Pivot point reports kept as files, split by pivot time: report name -> {time index: (filename, compression)}
+        self.__pivot_files: dict[str, dict[int, tuple[str, str]]] = {}
+        # SBA scenarios for each pivot time: {time index: scenario table}
+        self.__scenario_tables: dict[int, pd.DataFrame] = {}
+
         # Get the base projection that was run
         self.__base_projection = self.api.get_projection_details(self.base_projection_id)
         if self.__base_projection.get("status") not in ["Completed", "CompletedWithErrors"]:
@@ -53,14 +92,11 @@ class SbaSolver:
         self.model_id = self.__base_projection.get("model").get("id")
 
         # Get the Table IDs of the inputs needed from this model
-        table_structures = self.api.list_table_structures(self.model_id)
-
-        self.starting_assets_table_id = next((table.get("id") for table in table_structures if table.get("name") == settings.starting_asset_table_name),None)
-        self.epl_table_id = next((table.get("id") for table in table_structures if table.get("name") == settings.epl_table_name), None)
+        self.starting_assets_table_id = self.api.get_table_structure_id(self.model_id, settings.starting_asset_table_name)
+        self.epl_table_id = self.api.get_table_structure_id(self.model_id, settings.epl_table_name)
 
         # Get the Projection Template ID for the SBA Solver
-        projection_templates = self.api.list_projection_templates(self.model_id)
-        self.epl_projection_template_id = next((template.get("id") for template in projection_templates if template.get("name") == settings.sba_template_name), None)
+        self.epl_projection_template_id = self.api.get_projection_template_id(self.model_id, settings.sba_template_name)
 
     def calculate_bel_at_zero(self):
         logging.info(f"Starting SBA Solver for Time 0")
@@ -72,6 +108,7 @@ class SbaSolver:
                               "Scenario-ID": '1'}
 
         self.__create_liability_cash_flows(base_report_params)
+        self.__retrieve_pivot_data([0], ["Market Value Liability"], [])
 
         solve_params = SbaSolver.TimeSolveParams(0, use_epl=False, generate_asset_files=False, generate_scenario_file=False)
         result = self.__solve_at_time(solve_params)
@@ -93,30 +130,132 @@ class SbaSolver:
         base_report_params = {"Projection-ID": f"{self.base_projection_id}",
                               "Scenario-ID": '1'}
 
-        self.__create_liability_cash_flows(base_report_params)
-
-        for time_idx in time_indexes:
-            solve_params = SbaSolver.TimeSolveParams(time_idx)
-            result = self.__solve_at_time(solve_params)
-            self.final_bel.append({"Time": time_idx, "BEL": result["bel"], "ProjectionId": result["projectionId"], "Scenario": result["scenario"]})
+        try:
+            self.__create_liability_cash_flows(base_report_params)
+
+            # Pivot point data for every time point is downloaded up front, so each time point only has to look it up
+            # Time points after the last liability cash flow have a BEL of 0 and need no data
+            self.__retrieve_pivot_data([time_idx for time_idx in time_indexes if time_idx <= self.__last_cf_time],
+                                       ["Market Value Liability", "Asset Products", "Scenario Data"], ["Asset MPF"])
+
+            # The SBA scenarios of every pivot time are generated together
+            self.__scenario_tables = sba_scenarios.generate_scenario_tables(self.__pivot_data.get("Scenario Data", {}))
+
+            # Time points are independent once the liability cash flow table exists, so several are solved at the same time
+            # The number of solver projections running at once is capped across all of them by the projection slots
+            max_workers = max(1, min(settings.solver_max_concurrent_times, len(time_indexes)))
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="SbaTime") as executor:
+                futures = [executor.submit(self.__solve_time_point, time_idx) for time_idx in time_indexes]
+                for future in futures:
+                    future.result()
+            self.final_bel.sort(key=lambda result: result["Time"])
+        finally:
+            # Metrics are written even when a time point fails, as that is when the timings matter most
+            logging.info(f"Report cache statistics: {self.report_cache.get_statistics()}")
+            self.api.metrics.export(self.solver_folder + "API Metrics")
 
         # except Exception as e:
         #    logging.info(e)
         #    logging.info(traceback.format_exc())
         #    logging.info("SBA Solver Failed - BEL could not be calculated")
 
+    def __solve_time_point(self, time_idx: int):
+        solve_params = SbaSolver.TimeSolveParams(time_idx)
+        result = self.__solve_at_time(solve_params)
+        with self.__results_lock:
+            self.final_bel.append({"Time": time_idx, "BEL": result["bel"], "ProjectionId": result["projectionId"], "Scenario": result["scenario"],
+                                   "MaxError": result.get("maxError", "Unknown")})
+
+    # Download pivot point reports for all of the time indexes and split them by pivot time
+    # data_report_names are loaded into self.__pivot_data. file_report_names are kept as CSV files in self.__pivot_files,
+    # with each record copied unchanged, for reports that are uploaded back to SLOPE.
+    def __retrieve_pivot_data(self, time_indexes: list[int], data_report_names: list[str], file_report_names: list[str]):
+        time_indexes = sorted(set(time_indexes))
+        if len(time_indexes) == 0:
+            return
+
+        report_names = data_report_names + file_report_names
+        logging.info(f"Get {', '.join(report_names)} at times {time_indexes}.")
+        pivot_reports = self.__retrieve_pivot_reports(time_indexes, report_names)
+
+        for name in data_report_names:
+            report, reports = pivot_reports[name]
+            if report is not None:
+                self.__pivot_data[name] = self.__split_by_pivot_time(report.get_data(), self.__pivot_time_column(name), time_indexes)
+                report.cleanup()
+            else:
+                # Drop the pivot time column, if the report has it, so the data looks the same as when it is split
+                columns = [self.__pivot_time_column(name)] if self.__pivot_time_column(name) is not None else []
+                self.__pivot_data[name] = {time_idx: report.get_data().drop(columns=columns, errors="ignore") for time_idx, report in reports.items()}
+                for report in reports.values():
+                    report.cleanup()
+
+        for name in file_report_names:
+            report, reports = pivot_reports[name]
+            if report is not None:
+                files = {time_idx: f"{self.solver_folder}{name}_{time_idx}.csv" for time_idx in time_indexes}
+                self.__split_csv_by_column(report.get_filename(), report.compression, self.__pivot_time_column(name),
+                                           {str(time_idx): filename for time_idx, filename in files.items()})
+                report.cleanup()
+                self.__pivot_files[name] = {time_idx: (filename, None) for time_idx, filename in files.items()}
+            else:
+                # The downloaded files are used as they are and removed once they have been read
+                self.__pivot_files[name] = {time_idx: (report.get_filename(), report.compression) for time_idx, report in reports.items()}
+
+    # Retrieve pivot point reports for all of the time indexes, starting every report generation together
+    # Reports that declare a column for the Pivot-Time-Index filter are pulled once without that filter and still have to be
+    # split on the column. Returns report name -> (report, None) for these, and (None, {time index: report}) for reports
+    # retrieved once for each pivot time - either because they declare no column or because the report does not have it.
+    def __retrieve_pivot_reports(self, time_indexes: list[int], report_names: list[str]) -> dict[str, tuple[SigmaReport, dict[int, SigmaReport]]]:
+        base_params = {"Projection-ID": f"{self.base_projection_id}",
+                       "Scenario-ID": '1'}
+
+        # A single pivot time needs no splitting, so it is always retrieved with the filter
+        combined = {}
+        if len(time_indexes) > 1:
+            combined = {name: SigmaReport(self.api, self.reports[name], cache=self.report_cache)
+                        for name in report_names if self.__pivot_time_column(name) is not None}
+            SigmaReport.retrieve_all([(report, base_params) for report in combined.values()])
+
+        pivot_reports = {}
+        for name, report in combined.items():
+            column = self.__pivot_time_column(name)
+            if column in report.get_header():
+                pivot_reports[name] = (report, None)
+            else:
+                logging.warning(f"Report '{name}' has no '{column}' column. Retrieving it once for each pivot time instead.")
+                report.cleanup()
+
+        per_time = {name: {time_idx: SigmaReport(self.api, self.reports[name], cache=self.report_cache) for time_idx in time_indexes}
+                    for name in report_names if name not in pivot_reports}
+        SigmaReport.retrieve_all([(report, {**base_params, "Pivot-Time-Index": f"{time_idx}"})
+                                  for reports in per_time.values() for time_idx, report in reports.items()])
+        pivot_reports.update({name: (None, reports) for name, reports in per_time.items()})
+        return pivot_reports
+
+    # Report column declared for the Pivot-Time-Index filter in reports.json, or None
+    def __pivot_time_column(self, report_name: str) -> str:
+        return (self.reports[report_name].filter_columns or {}).get("Pivot-Time-Index")
+
+    # Split report data into {time index: data} with the pivot time column removed
+    # Every time index gets an entry, even if the report has no rows for it
+    @staticmethod
+    def __split_by_pivot_time(data: pd.DataFrame, column: str, time_indexes: list[int]) -> dict[int, pd.DataFrame]:
+        split = {int(time_idx): rows.drop(columns=column).reset_index(drop=True) for time_idx, rows in data.groupby(column, sort=False)}
+        empty = data.iloc[0:0].drop(columns=column)
+        return {time_idx: split.get(time_idx, empty) for time_idx in time_indexes}
+
     def print_results(self):
         print("Results:")
         for result in self.final_bel:
             print(f"Time {result['Time']}: Projection({result['ProjectionId']}) Scenario({result['Scenario']}) BEL: {result['BEL']}")
 
-    def __create_asset_mpfs(self, time_index, report_params):
-        products_report = SigmaReport(self.api, self.reports["Asset Products"])
-        products_report.retrieve(report_params)
-        products = products_report.get_data()
-        self.__asset_market_value = products['Market Value at Pivot Time'].sum()
-
+    def __create_asset_mpfs(self, time_index, products: pd.DataFrame):
+        # The model points of every product at this pivot time were downloaded up front
+        filename, compression = self.__pivot_files["Asset MPF"].pop(time_index)
         if time_index == 0:
+            os.remove(filename)
+
             # For time 0, we can just use the existing asset MPFs from the base projection
             base_products = self.__base_projection.get("portfolios")[0].get("products")
 
@@ -129,91 +268,169 @@ class SbaSolver:
 
             return assets
 
-        assets = []
-        report = SigmaReport(self.api, self.reports["Asset MPF"])
-        for product in products['Product Name']:
-            report_params["Product-Name"] = product
-
-            # Download MPF as of the point in time
-            logging.info(f"Creating Asset MPF for {product}")
-            report.retrieve(report_params)
-            
-            mpf_file_name = product + "_" + str(time_index) + ".csv"
-
-            # Save it to file manager
-            file_id = self.api.upload_file(report.get_filename(), f"{self.slope_file_path}/{mpf_file_name}")
-            assets.append({"productName": product,
-                           "modelPointFile": {"fileId": file_id}})
+        mpf_files = {product: product + "_" + str(time_index) + ".csv" for product in products['Product Name']}
+        logging.info(f"Creating Asset MPFs for {len(mpf_files)} products")
+        product_column = (self.reports["Asset MPF"].filter_columns or {}).get("Product-Name")
+        if product_column is not None and product_column in self.__csv_header(filename, compression):
+            # Split the model points by product
+            self.__split_csv_by_column(filename, compression, product_column,
+                                       {product: self.solver_folder + mpf_file_name for product, mpf_file_name in mpf_files.items()})
+        else:
+            # The report cannot be split by product, so the model points of each product are retrieved on their own
+            if product_column is not None:
+                logging.warning(f"Report 'Asset MPF' has no '{product_column}' column. Retrieving it once for each product instead.")
+            product_reports = {product: SigmaReport(self.api, self.reports["Asset MPF"], cache=self.report_cache) for product in mpf_files}
+            SigmaReport.retrieve_all([(report, {"Projection-ID": f"{self.base_projection_id}",
+                                                "Scenario-ID": '1',
+                                                "Pivot-Time-Index": f"{time_index}",
+                                                "Product-Name": product}) for product, report in product_reports.items()])
+            for product, report in product_reports.items():
+                with open_file(report.get_filename(), "rb", report.compression) as infile, open(self.solver_folder + mpf_files[product], "wb") as outfile:
+                    shutil.copyfileobj(infile, outfile)
+                report.cleanup()
+        os.remove(filename)
+
+        # Save them to file manager
+        with ThreadPoolExecutor(max_workers=max(1, min(settings.asset_mpf_max_concurrent_uploads, len(mpf_files))), thread_name_prefix="MpfUpload") as executor:
+            uploads = {product: executor.submit(self.api.upload_file, self.solver_folder + mpf_file_name, f"{self.slope_file_path}/{mpf_file_name}")
+                       for product, mpf_file_name in mpf_files.items()}
+            assets = [{"productName": product,
+                       "modelPointFile": {"fileId": upload.result()}} for product, upload in uploads.items()]
 
         return assets
 
+    # Split a CSV file into one file per value of a column
+    # Records are copied byte for byte, so each output holds exactly what was downloaded. Every output gets the header,
+    # even when it has no records. Records with a value that is not in output_files are dropped.
+    # The file is split a block at a time: each block is parsed in one pass to get the column value of every record,
+    # then each run of consecutive records with the same value is written out with a single write.
+    @staticmethod
+    def __split_csv_by_column(filename: str, compression: str, column: str, output_files: dict[str, str]):
+        outputs = {}
+        try:
+            with open_file(filename, "rb", compression) as infile:
+                header = infile.readline()
+                columns = SbaSolver.__parse_csv_header(header)
+                if column not in columns:
+                    raise ValueError(f"Report '{filename}' must include a '{column}' column.")
+                column_index = columns.index(column)
+
+                for value, output_file in output_files.items():
+                    outputs[value] = open(output_file, "wb")
+                    outputs[value].write(header)
+
+                remainder = b""
+                while True:
+                    chunk = infile.read(SbaSolver.split_block_size)
+                    data = remainder + chunk
+                    if len(data) == 0:
+                        break
+                    record_ends = SbaSolver.__csv_record_ends(data)
+                    if chunk:
+                        # Keep the partial record at the end of the block for the next one
+                        remainder = data[record_ends[-1]:] if len(record_ends) > 0 else data
+                        data = data[:record_ends[-1]] if len(record_ends) > 0 else b""
+                    else:
+                        # Last block - the final record may have no line break
+                        remainder = b""
+                        if len(record_ends) == 0 or record_ends[-1] < len(data):
+                            record_ends = np.append(record_ends, len(data))
+                    if len(data) > 0:
+                        SbaSolver.__write_csv_runs(data, record_ends, column_index, outputs)
+                    if not chunk:
+                        break
+        finally:
+            for output in outputs.values():
+                output.close()
+
+    # Column names of a CSV file
+    @staticmethod
+    def __csv_header(filename: str, compression: str) -> list[str]:
+        with open_file(filename, "rb", compression) as infile:
+            return SbaSolver.__parse_csv_header(infile.readline())
+
+    @staticmethod
+    def __parse_csv_header(header: bytes) -> list[str]:
+        return next(csv.reader(io.StringIO(header.decode("utf-8-sig"), newline="")), [])
+
+    # Offsets just past the end of each complete record in a block of CSV bytes
+    # A line break ends a record unless it is inside a quoted value, i.e. after an odd number of quote characters
+    @staticmethod
+    def __csv_record_ends(data: bytes) -> np.ndarray:
+        buffer = np.frombuffer(data, dtype=np.uint8)
+        line_breaks = np.flatnonzero(buffer == ord("\n"))
+        quotes = np.cumsum(buffer == ord('"'))
+        return line_breaks[quotes[line_breaks] % 2 == 0] + 1
+
+    # Write the records of a block to the output for their value of the column at column_index
+    @staticmethod
+    def __write_csv_runs(data: bytes, record_ends: np.ndarray, column_index: int, outputs: dict):
+        rows = csv.reader(io.StringIO(data.decode("utf-8"), newline=""))
+        values = np.array([row[column_index] if len(row) > column_index else None for row in rows], dtype=object)
+        if len(values) != len(record_ends):
+            raise ValueError(f"Found {len(values)} CSV rows but {len(record_ends)} records while splitting on column {column_index}.")
+
+        record_starts = np.concatenate(([0], record_ends[:-1]))
+        run_starts = np.concatenate(([0], np.flatnonzero(values[1:] != values[:-1]) + 1))
+        run_ends = np.append(run_starts[1:], len(values))
+        for run_start, run_end in zip(run_starts, run_ends):
+            output = outputs.get(values[run_start])
+            if output is not None:
+                output.write(data[record_starts[run_start]:record_ends[run_end - 1]])
+
     def __create_liability_cash_flows(self, report_params):
         # Get Liability cash flows from SLOPE
-        report = SigmaReport(self.api, self.reports["Liability Cash Flows"])
+        report = SigmaReport(self.api, self.reports["Liability Cash Flows"], cache=self.report_cache)
         report.retrieve(report_params)
-        epl_data = report.get_data()
-
-        # Find time of last cash flow - we must explicitly convert this from a numpy.int64 type to an int here, otherwise it will fail to be serialized in json later
-        self.__last_cf_time = int(epl_data["Time Index"].max())
-
-        # Add an empty data row at the bottom to catch any missing months if the cash flows are spare and populate with 0 cash flows
-        epl_data.loc[epl_data.index.max() + 1] = ["", "", 0]
-
-        # Add required index columns
-        epl_data["Liability ID"] = "BEL"
-        epl_data["Scenario Number"] = ""
 
-        # Add additional columns required by the table structure
         epl_table_columns = self.api.get_table_structure_columns(self.epl_table_id)
-        for column in epl_table_columns:
-            column_name = column["name"]
-            if column_name not in epl_data.columns:
-                epl_data[column_name] = 0
 
-        # Write final updated EPL file to a csv file
-        epl_data.to_csv(report.get_filename(), index=False)
+        def add_epl_columns(epl_data):
+            # Add required index columns
+            epl_data["Liability ID"] = "BEL"
+            epl_data["Scenario Number"] = ""
+
+            # Add additional columns required by the table structure
+            for column in epl_table_columns:
+                column_name = column["name"]
+                if column_name not in epl_data.columns:
+                    epl_data[column_name] = 0
+            return epl_data
+
+        # Read the cash flows a batch at a time and write the EPL file as we go, so the whole report is never held in memory
+        epl_filename = self.solver_folder + "liability_cash_flows.csv"
+        last_cf_times = []
+        report_columns = report.get_header()
+        with open(epl_filename, 'w', newline='') as epl_file:
+            header = True
+            for epl_data in report.iter_batches():
+                report_columns = list(epl_data.columns)
+                last_cf_times.append(epl_data["Time Index"].max())
+                add_epl_columns(epl_data).to_csv(epl_file, index=False, header=header)
+                header = False
+
+            # Add an empty data row at the bottom to catch any missing months if the cash flows are spare and populate with 0 cash flows
+            empty_row = pd.DataFrame([["", "", 0]], columns=report_columns)
+            add_epl_columns(empty_row).to_csv(epl_file, index=False, header=header)
+
+        # Find time of last cash flow - we must explicitly convert this from a numpy.int64 type to an int here, otherwise it will fail to be serialized in json later
+        self.__last_cf_time = int(max(last_cf_times))
 
         # Upload the EPL cash flows to SLOPE
         logging.info("Create EPL table for liability cash flows for BEL runs")
-        self.liability_cashflows_table_id = self.api.create_or_update_data_table(report.get_filename(), {
+        self.liability_cashflows_table_id = self.api.create_or_update_data_table(epl_filename, {
             "tableStructureId": self.epl_table_id,
             "name": f"{self.base_projection_id} Cash Flows",
             "filePath": f"{self.slope_file_path}/Liability Cash Flows.csv",
             "delimiter": ","
         })
+        report.cleanup()
 
 
-    def __create_scenario_file(self, time_index, valuation_date, report_params):
-        logging.info(f"Get starting spot curve at time {time_index}")
-        # Get Scenario Spot Rates as of the Pivot Point
-        scenario_report = SigmaReport(self.api, self.reports["Scenario Data"])
-        scenario_report.retrieve(report_params)
-        spot_curve = scenario_report.get_data()
-
+    def __create_scenario_file(self, time_index, valuation_date, scenarios: pd.DataFrame):
         scenario_file = self.solver_folder + f"sba_scenarios_time_{time_index}.xlsx"
         logging.info(f"Creating new SBA scenario file at '{scenario_file}'")
-        scenario_generator = openpyxl.load_workbook(filename=settings.sba_scenario_generator, read_only=False)
-        sheet = scenario_generator["Input"]
-
-        # Write pivot point scenario values to scenario generator to create SBA scenarios
-        rows = dataframe_to_rows(spot_curve, index=False, header=False)
-        for r_idx, row in enumerate(rows, 1):
-            for c_idx, df_value in enumerate(row, 1):
-                # if c_idx > 1:
-                sheet.cell(row=r_idx + 4, column=c_idx + 1, value=df_value)
-
-        scenario_generator.save(scenario_file)
-        scenario_generator.close()
-
-        # openpyxl is great for updating data, but it doesn't recalculate formulas, which is kind of important for this step
-        # Open, Save, and close the workbook using Excel through a COM call to re-save it with formulas updated
-        # This step only works on a Windows OS with MS Excel installed (sorry)
-        # If you get weird COM errors in this section, it is probably due to an open dialog stuck in Excel. Manually close all Excel files and rerun
-        excel = win32.DispatchEx('Excel.Application')
-        workbook = excel.Workbooks.Open(scenario_file)
-        workbook.Save()
-        workbook.Close()
-        excel.Quit()
+        sba_scenarios.write_scenario_file(scenarios, scenario_file)
 
         # Upload SBA Scenarios to SLOPE
         logging.info(f"Load scenario file to slope at '{self.slope_file_path}/Time-{time_index} SBA Scenarios.xlsx'")
@@ -227,24 +444,21 @@ class SbaSolver:
         scenario_table_id = self.api.create_or_update_scenario_table(scenario_file, scenario_params)
         return scenario_table_id
 
+    # Download the results of a solver projection that has finished running
     def __get_solver_results(self, projection_id, guesses) -> tuple[int, float]:
-        # Wait for projection to finish
-        while self.api.is_projection_running(projection_id):
-            status = self.api.get_projection_status(projection_id)
-            logging.info(f"Waiting for Projection ID {projection_id} to finish. Current status: {status}")
-            time.sleep(30)  # Check once every 30 seconds if it is done
-
-        # Download Results
-        report = SigmaReport(self.api, self.reports["Solver Results"])
-        report.retrieve({"Projection-ID": f"{projection_id}"})
+        report = SigmaReport(self.api, self.reports["Solver Results"], cache=self.report_cache)
+        # Results may still be loading into Snowflake, so they are never served from the cache
+        report.retrieve({"Projection-ID": f"{projection_id}"}, use_cache=False)
         sba_result = report.get_data()
+        report.cleanup()
 
         if len(sba_result) < 9:
             # Data is not loaded to Snowflake yet, so wait and try again up to 5 times
             for attempt in range(5):
                 time.sleep(20)  # Wait 20 seconds before retrying
-                report.retrieve({"Projection-ID": f"{projection_id}"})
+                report.retrieve({"Projection-ID": f"{projection_id}"}, use_cache=False)
                 sba_result =report.get_data()
+                report.cleanup()
                 if (len(sba_result) >= 9):
                     break
 
@@ -285,15 +499,8 @@ class SbaSolver:
 
         logging.info(f"Solving for BEL at time {params.time_index}:")
 
-        pivot_point_report_params = {"Projection-ID": f"{self.base_projection_id}",
-                                     "Scenario-ID": '1',
-                                     "Pivot-Time-Index": f"{params.time_index}"}
-
-        # Get Market Value of Liabilities at this pivot point
-        logging.info(f"Get starting market value liabilities at time {params.time_index}.")
-        report = SigmaReport(self.api, self.reports["Market Value Liability"])
-        report.retrieve(pivot_point_report_params)
-        mvl_data = report.get_data()
+        # Market Value of Liabilities, Asset Products and Scenario Spot Rates at this pivot point were downloaded up front
+        mvl_data = self.__pivot_data["Market Value Liability"][params.time_index]
         valuation_date = datetime.datetime.fromisoformat(mvl_data["Date"].iloc[0])
 
         market_value_liabilities = mvl_data["Market Value"].iloc[0]
@@ -321,36 +528,34 @@ class SbaSolver:
         if params.generate_scenario_file:
             # Create Scenario File for this pivot point
             logging.info(f"Create Scenario file at time {params.time_index}")
-            solver_projection_parameters["scenarioTableId"] = self.__create_scenario_file(params.time_index, valuation_date, pivot_point_report_params)
+            solver_projection_parameters["scenarioTableId"] = self.__create_scenario_file(params.time_index, valuation_date, self.__scenario_tables[params.time_index])
 
+        asset_market_value = 0
         if params.generate_asset_files:
             # Create Asset MPFs at Pivot Time Index
             logging.info(f"Get starting asset model points at time {params.time_index}")
-            assets = self.__create_asset_mpfs(params.time_index, pivot_point_report_params)
+            products = self.__pivot_data["Asset Products"][params.time_index]
+            asset_market_value = products['Market Value at Pivot Time'].sum()
+            assets = self.__create_asset_mpfs(params.time_index, products)
             solver_projection_parameters["portfolios"] = [{
                 "portfolioName": "Inforce Portfolio",
                 "products": assets
             }]
 
         # Start Initial Guesses for solver
-        starting_guess = market_value_liabilities if market_value_liabilities > 0 else self.__asset_market_value
+        starting_guess = market_value_liabilities if market_value_liabilities > 0 else asset_market_value
         if starting_guess <= 0:
             starting_guess = 10000000  # If both MVL and Asset MV are 0 or negative, just start at 10 million
-        solver_projections = []
         guess_num = 1
 
         # Low - 90% of starting guess
-        starting_assets = [starting_guess * 0.95] * 10
-        solver_projections.append(self.__start_run(starting_assets, params.time_index, solver_projection_parameters, guess_num, params.use_epl))
-        guess_num += 1
         # Mid - 99.5% of starting guess
-        starting_assets = [starting_guess * 0.995] * 10
-        solver_projections.append(self.__start_run(starting_assets, params.time_index, solver_projection_parameters, guess_num, params.use_epl))
-        guess_num += 1
         # High - 110% of MVL
-        starting_assets = [starting_guess * 1.1] * 10
-        solver_projections.append(self.__start_run(starting_assets, params.time_index, solver_projection_parameters, guess_num, params.use_epl))
-        guess_num += 1
+        starting_guesses = [[starting_guess * 0.95] * 10,
+                            [starting_guess * 0.995] * 10,
+                            [starting_guess * 1.1] * 10]
+        solver_projections = self.__start_runs(starting_guesses, params.time_index, solver_projection_parameters, guess_num, params.use_epl)
+        guess_num += len(solver_projections)
 
         # Iteration
         best_guess = {
@@ -364,30 +569,55 @@ class SbaSolver:
         for i in range(1, 9):
             guesses[i] = []
 
-        for i in range(self.__max_iterations):
-            for projection_id in solver_projections:
+        # Results are harvested in the order the projections finish, not the order they were started
+        # The next round of guesses starts as soon as every scenario has results on both sides of 0 and the current round
+        # has reported at least once - otherwise once every projection of the current round has finished.
+        pending = dict(solver_projections)
+        current_round = set(solver_projections.values())
+        current_round_reported = False
+        rounds_started = 1
+        while len(pending) > 0:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                projection_id = pending.pop(future)
+                # The watcher has already seen the projection finish - this raises if watching it failed
+                future.result()
                 this_guess = self.__get_solver_results(projection_id, guesses)
                 # if within tolerance, stop here
                 if this_guess["tolerance"] <= self.__tolerance:
+                    if len(pending) > 0:
+                        # There is no way to cancel a running projection - the rest are left to finish, but their results are not needed
+                        logging.info(f"Time {params.time_index} solved. Abandoning the results of projections {sorted(pending.values())}.")
                     return this_guess
                 if this_guess["tolerance"] < best_guess["tolerance"]:
                     best_guess = this_guess
-
+                if projection_id in current_round:
+                    current_round_reported = True
 
             # if outside tolerance and not at max iterations, create next set of guesses and iterate again
-            if i < self.__max_iterations - 1:
-                solver_projections = []
-                for guess in self.__solve_next_guess(guesses):
-                    solver_projections.append(self.__start_run(guess, params.time_index, solver_projection_parameters, guess_num, params.use_epl))
-                    guess_num += 1
-
-        self.__calculate_max_error(guesses, best_guess['scenario'])
+            round_finished = current_round.isdisjoint(pending.values())
+            if rounds_started < self.__max_iterations and (round_finished or (current_round_reported and self.__is_bracketed(guesses))):
+                solver_projections = self.__start_runs(self.__solve_next_guess(guesses), params.time_index, solver_projection_parameters, guess_num, params.use_epl)
+                guess_num += len(solver_projections)
+                pending.update(solver_projections)
+                current_round = set(solver_projections.values())
+                current_round_reported = False
+                rounds_started += 1
+
+        best_guess["maxError"] = self.__calculate_max_error(guesses, best_guess['scenario'])
         logging.info(f"No projection within tolerance after {self.__max_iterations}.")
         logging.info(f"Best guess of {best_guess['bel']} with final difference of {best_guess['tolerance']}.")
-        logging.info(f"Maximum Potential Error in BEL: {self.max_error}")
+        logging.info(f"Maximum Potential Error in BEL at time {params.time_index}: {best_guess['maxError']}")
         return best_guess
 
-    def __calculate_max_error(self, prior_results: dict[int, float], scenario: int):
+    # True when every scenario has at least one result below 0 and one at or above 0
+    @staticmethod
+    def __is_bracketed(prior_results: dict[int, list]) -> bool:
+        return all(any(guess['result'] < 0 for guess in guesses) and any(guess['result'] >= 0 for guess in guesses)
+                   for guesses in prior_results.values())
+
+    # Returns the maximum potential error in the BEL of a scenario from the guesses bracketing 0
+    def __calculate_max_error(self, prior_results: dict[int, float], scenario: int) -> str:
         guesses = prior_results[scenario]
 
         # Find the 2 closest points to 0
@@ -398,9 +628,27 @@ class SbaSolver:
 
         if index_low is None or index_high is None:
             self.max_error = "Unknown"
-            return
+            return self.max_error
         
         self.max_error = str(abs(guesses[index_high]['value'] - guesses[index_low]['value'])/2)
+        return self.max_error
+
+    # Start a round of solver projections, one for each list of starting assets
+    # Waits until there are projection slots free for the whole round. Each slot is freed when its projection finishes.
+    # Returns a dict of the Future that completes when each projection finishes -> projection ID
+    def __start_runs(self, guesses: list[list[float]], time_index, projection_params, guess_num: int, use_epl: bool) -> dict[Future, int]:
+        self.__projection_slots.acquire(len(guesses))
+        projections = {}
+        try:
+            for starting_assets in guesses:
+                projection_id = self.__start_run(starting_assets, time_index, projection_params, guess_num + len(projections), use_epl)
+                future = self.api.projection_watcher.watch(projection_id, callback=lambda future: self.__projection_slots.release())
+                projections[future] = projection_id
+        except Exception:
+            # Free the slots of the projections that were never started
+            self.__projection_slots.release(len(guesses) - len(projections))
+            raise
+        return projections
 
     def __start_run(self, starting_assets: list[float], time_index, projection_params, guess_num: int, use_epl: bool) -> int:
         # Write new starting asset values to a table
@@ -408,7 +656,7 @@ class SbaSolver:
         df = df.rename(columns={df.columns[0]: "Scaling Target"})
         df['Scenario #'] = range(len(df))
         df['Scaling Factor'] = None
-        starting_assets_file = self.solver_folder + "sba_assets.csv"
+        starting_assets_file = self.solver_folder + f"sba_assets_time_{time_index}_guess_{guess_num}.csv"
         df.to_csv(starting_assets_file, index=False)
         logging.info(f"Starting run for BEL solve:")
         logging.info(df)
@@ -416,7 +664,7 @@ class SbaSolver:
         # Upload starting asset values to SLOPE
         table_params = {"tableStructureId": self.starting_assets_table_id,
                         "name": f"{self.base_projection_id}-{time_index} SBA Solver Guess {guess_num}",
-                        "filePath": f"{self.slope_file_path}/sba_assets.csv",
+                        "filePath": f"{self.slope_file_path}/sba_assets_time_{time_index}_guess_{guess_num}.csv",
                         "isFileOnly": False,
                         "delimiter": ","}
         starting_assets_table_id = self.api.create_or_update_data_table(starting_assets_file, table_params)
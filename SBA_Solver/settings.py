@@ -6,7 +6,9 @@ api_secret = secret
 
 solver_folder = "C:\\Slope Api\\SBA Solver\\"     # Temporary folder on this computer for storing data
 
-sba_scenario_generator = solver_folder + "SBA Scenario Generator.xlsx"
+report_cache_folder = solver_folder + "Report Cache\\"    # Downloaded reports are kept here and reused when the same report is requested again
+report_cache_max_bytes = 10 * 1024 ** 3                   # Least recently used reports are removed once the cache grows past this size
+metadata_cache_file = solver_folder + "metadata_cache.json"  # Model table structure and template IDs are shared here between solver runs
 
 # Usage Notes
 # The sba_template_name specified in this setting MUST have the following:
@@ -26,3 +28,6 @@ virtual_folder_name = "SBA Solver"                           # The name of the v
 solver_final_asset_tolerance = 5000000        # tolerance for remaining assets for the BEL solve - Higher tolerances will converge faster
 solver_max_iterations = 4                   # The maximum number of attempts to solve for BEL. If max iterations is exceeded, the last closes guess outside the tolerance will be used
 next_guess_range = 0.20                     # Check a 20% weighted average range around the last guess
+solver_max_concurrent_times = 4             # Number of time points solved at the same time. Set to 1 to solve one time point after another
+solver_max_projections_in_flight = 12       # Maximum number of solver projections running at once across all time points (at least 3)
+asset_mpf_max_concurrent_uploads = 8        # Number of asset model point files uploaded to SLOPE at the same time
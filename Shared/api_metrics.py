@@ -0,0 +1,133 @@
+import json
+import logging
+import re
+import threading
+from urllib.parse import urlsplit
+
+
+# Records per-endpoint statistics for every HTTP call made by SlopeApi
+# Attach record_response as a response hook on a requests.Session. Calls are grouped by HTTP method and logical
+# endpoint - the URL path relative to the API with ids replaced by {id} (e.g. "POST Reports/Workbooks/{id}/Generate").
+# Calls to presigned object store URLs are grouped as "ObjectStore".
+# For each endpoint this keeps the call count, a latency histogram, bytes sent and received, retry count and the
+# distribution of HTTP status codes. Results can be exported as a Prometheus text file or a JSON summary.
+class ApiMetrics:
+    latency_buckets = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]     # Seconds
+
+    def __init__(self, api_url: str):
+        self.api_url = api_url.rstrip("/")
+        self.__endpoints = {}
+        self.__lock = threading.Lock()
+
+    # Logical endpoint name for a request URL
+    def endpoint_name(self, url: str) -> str:
+        if not url.startswith(self.api_url):
+            return "ObjectStore"
+        path = urlsplit(url[len(self.api_url):]).path.strip("/")
+        # Anything that looks like an id (all digits, or a long token containing digits) is replaced with {id}
+        segments = ["{id}" if segment.isdigit() or (len(segment) >= 6 and re.search(r"\d", segment)) else segment
+                    for segment in path.split("/")]
+        return "/".join(segments)
+
+    # requests response hook
+    def record_response(self, response, *args, **kwargs):
+        request = response.request
+        bytes_sent = int(request.headers.get("Content-Length", 0) or 0)
+        bytes_received = int(response.headers.get("Content-Length", 0) or 0)
+        retries = getattr(getattr(response.raw, "retries", None), "history", None) or ()
+        self.record(request.method, self.endpoint_name(request.url), response.status_code,
+                    response.elapsed.total_seconds(), bytes_sent, bytes_received, len(retries))
+
+    def record(self, method: str, endpoint: str, status_code: int, latency: float, bytes_sent: int = 0, bytes_received: int = 0, retries: int = 0):
+        key = (method, endpoint)
+        with self.__lock:
+            stats = self.__endpoints.get(key)
+            if stats is None:
+                stats = {
+                    "count": 0,
+                    "latency_sum": 0.0,
+                    "latency_max": 0.0,
+                    "latency_buckets": [0] * len(self.latency_buckets),
+                    "bytes_sent": 0,
+                    "bytes_received": 0,
+                    "retries": 0,
+                    "status_codes": {}
+                }
+                self.__endpoints[key] = stats
+
+            stats["count"] += 1
+            stats["latency_sum"] += latency
+            stats["latency_max"] = max(stats["latency_max"], latency)
+            for i, bucket in enumerate(self.latency_buckets):
+                if latency <= bucket:
+                    stats["latency_buckets"][i] += 1
+            stats["bytes_sent"] += bytes_sent
+            stats["bytes_received"] += bytes_received
+            stats["retries"] += retries
+            status = str(status_code)
+            stats["status_codes"][status] = stats["status_codes"].get(status, 0) + 1
+
+    # Returns a summary of the recorded calls, keyed by "METHOD endpoint"
+    def get_summary(self) -> dict:
+        with self.__lock:
+            summary = {}
+            for (method, endpoint), stats in sorted(self.__endpoints.items(), key=lambda item: item[0][1]):
+                summary[f"{method} {endpoint}"] = {
+                    "count": stats["count"],
+                    "total_seconds": stats["latency_sum"],
+                    "mean_seconds": stats["latency_sum"] / stats["count"],
+                    "max_seconds": stats["latency_max"],
+                    "latency_histogram": {str(bucket): count for bucket, count in zip(self.latency_buckets, stats["latency_buckets"])},
+                    "bytes_sent": stats["bytes_sent"],
+                    "bytes_received": stats["bytes_received"],
+                    "retries": stats["retries"],
+                    "status_codes": dict(stats["status_codes"])
+                }
+            return summary
+
+    def export_json(self, filename: str):
+        with open(filename, "w") as file:
+            json.dump(self.get_summary(), file, indent=4)
+
+    def export_prometheus(self, filename: str):
+        with self.__lock:
+            endpoints = sorted(self.__endpoints.items(), key=lambda item: item[0][1])
+            lines = [
+                "# HELP slope_api_requests_total Number of HTTP calls made by SlopeApi.",
+                "# TYPE slope_api_requests_total counter"
+            ]
+            for (method, endpoint), stats in endpoints:
+                for status, count in sorted(stats["status_codes"].items()):
+                    lines.append(f'slope_api_requests_total{{method="{method}",endpoint="{endpoint}",status="{status}"}} {count}')
+
+            lines += [
+                "# HELP slope_api_request_duration_seconds Time from sending an HTTP call to receiving the response headers.",
+                "# TYPE slope_api_request_duration_seconds histogram"
+            ]
+            for (method, endpoint), stats in endpoints:
+                labels = f'method="{method}",endpoint="{endpoint}"'
+                for bucket, count in zip(self.latency_buckets, stats["latency_buckets"]):
+                    lines.append(f'slope_api_request_duration_seconds_bucket{{{labels},le="{bucket}"}} {count}')
+                lines.append(f'slope_api_request_duration_seconds_bucket{{{labels},le="+Inf"}} {stats["count"]}')
+                lines.append(f'slope_api_request_duration_seconds_sum{{{labels}}} {stats["latency_sum"]}')
+                lines.append(f'slope_api_request_duration_seconds_count{{{labels}}} {stats["count"]}')
+
+            for metric, field, description in [("slope_api_bytes_sent_total", "bytes_sent", "Request body bytes sent."),
+                                               ("slope_api_bytes_received_total", "bytes_received", "Response body bytes received."),
+                                               ("slope_api_retries_total", "retries", "Automatic retries of HTTP calls.")]:
+                lines += [f"# HELP {metric} {description}", f"# TYPE {metric} counter"]
+                for (method, endpoint), stats in endpoints:
+                    lines.append(f'{metric}{{method="{method}",endpoint="{endpoint}"}} {stats[field]}')
+
+        with open(filename, "w") as file:
+            file.write("\n".join(lines) + "\n")
+
+    # Write both exports to <filename>.prom and <filename>.json
+    # A failure to write them is logged rather than raised, so it never fails the run the metrics were collected for
+    def export(self, filename: str):
+        logging.info(f"Writing API metrics to '{filename}.prom' and '{filename}.json'")
+        try:
+            self.export_prometheus(f"{filename}.prom")
+            self.export_json(f"{filename}.json")
+        except OSError as e:
+            logging.warning(f"Could not write API metrics: {e}")
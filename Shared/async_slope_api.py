@@ -0,0 +1,146 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import pandas as pd
+from Shared.slope_api import SlopeApi
+
+
+# Coroutine version of the SlopeApi client
+# Every call is run on a worker thread from the client's own pool against a single SlopeApi instance, so all requests share one pooled
+# requests.Session and one auth token. SlopeApi keeps the token refreshed from a background thread, so tasks never
+# wait on each other to check it.
+# Example:
+#   api = AsyncSlopeApi()
+#   await api.authorize(key, secret)
+#   results = await asyncio.gather(*(api.update_projection(pid, props) for pid in projection_ids))
+class AsyncSlopeApi:
+    def __init__(self, max_concurrent_requests: int = 32, api: SlopeApi = None):
+        # Size the connection pool to match the number of requests allowed in flight so no task waits on a socket
+        self.api = api if api is not None else SlopeApi(pool_size=max_concurrent_requests)
+        self.max_concurrent_requests = max_concurrent_requests
+        self.__semaphore = None
+        # The event loop's default executor is capped at a few threads per CPU, so calls get a pool of their own
+        # with a worker for every request allowed in flight
+        self.__executor = ThreadPoolExecutor(max_workers=max_concurrent_requests, thread_name_prefix="AsyncSlopeApi")
+
+    # The semaphore has to be created inside the running event loop
+    def __get_semaphore(self) -> asyncio.Semaphore:
+        if self.__semaphore is None:
+            self.__semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        return self.__semaphore
+
+    # Run a blocking SlopeApi call on a worker thread, limiting the number of calls in flight at once
+    async def __call(self, func, *args, **kwargs):
+        async with self.__get_semaphore():
+            return await asyncio.get_running_loop().run_in_executor(self.__executor, functools.partial(func, *args, **kwargs))
+
+    async def authorize(self, key: str, secret: str):
+        await self.__call(self.api.authorize, key, secret)
+
+    async def refresh(self):
+        await self.__call(self.api.refresh)
+
+    def close(self):
+        self.__executor.shutdown(wait=False)
+        self.api.close()
+
+    async def upload_file(self, filename: str, slope_path: str) -> int:
+        return await self.__call(self.api.upload_file, filename, slope_path)
+
+    async def copy_projection(self, projection_id: int, name: str, update_tables: bool = True) -> int:
+        return await self.__call(self.api.copy_projection, projection_id, name, update_tables)
+
+    async def create_data_table(self, filename: str, slope_table_params) -> int:
+        return await self.__call(self.api.create_data_table, filename, slope_table_params)
+
+    async def create_or_update_data_table(self, filename: str, slope_table_params) -> int:
+        return await self.__call(self.api.create_or_update_data_table, filename, slope_table_params)
+
+    async def create_decrement_table(self, filename: str, slope_table_params) -> int:
+        return await self.__call(self.api.create_decrement_table, filename, slope_table_params)
+
+    async def create_only_decrement_table(self, slope_table_params) -> int:
+        return await self.__call(self.api.create_only_decrement_table, slope_table_params)
+
+    async def create_projection_from_template(self, template_id: int, name: str) -> int:
+        return await self.__call(self.api.create_projection_from_template, template_id, name)
+
+    async def create_scenario_table(self, filename: str, slope_scenario_table_params) -> int:
+        return await self.__call(self.api.create_scenario_table, filename, slope_scenario_table_params)
+
+    async def create_or_update_scenario_table(self, filename: str, slope_scenario_table_params) -> int:
+        return await self.__call(self.api.create_or_update_scenario_table, filename, slope_scenario_table_params)
+
+    async def generate_workbook_report(self, workbook_id: str, element_id: str, format_type: str, parameters: dict, row_limit: int = None, offset: int = None) -> dict:
+        return await self.__call(self.api.generate_workbook_report, workbook_id, element_id, format_type, parameters, row_limit, offset)
+
+    async def get_workbook_report_status(self, generation_id: str) -> dict:
+        return await self.__call(self.api.get_workbook_report_status, generation_id)
+
+    # Generate and download a report without holding a worker thread while the report is being generated
+    async def download_report(self, workbook_id: str, element_id: str, filename: str, format_type: str, parameters: dict, row_limit=None, offset=None, timeout=900, chunk_handler=None, compression: str = None):
+        generation = await self.__call(self.api.report_scheduler.submit, workbook_id, element_id, format_type, parameters, row_limit, offset, timeout)
+        download_url = await asyncio.wrap_future(generation)
+        return await self.__call(self.api.download_generated_report, download_url, filename, chunk_handler, compression)
+
+    async def download_and_load_report(self, workbook_id: str, element_id: str, filename: str, format_type: str, parameters: dict) -> pd.DataFrame:
+        return await self.__call(self.api.download_and_load_report, workbook_id, element_id, filename, format_type, parameters)
+
+    async def get_data_table_by_id(self, data_table_id: int, dtype_backend: str = None) -> pd.DataFrame:
+        return await self.__call(self.api.get_data_table_by_id, data_table_id, dtype_backend)
+
+    async def get_data_table_by_name(self, table_name: str, table_structure_id: int, version: int = None, dtype_backend: str = None) -> pd.DataFrame:
+        return await self.__call(self.api.get_data_table_by_name, table_name, table_structure_id, version, dtype_backend)
+
+    async def get_projection_details(self, projection_id: int, fields: list[str] = None):
+        return await self.__call(self.api.get_projection_details, projection_id, fields)
+
+    async def get_projection_status(self, projection_id) -> str:
+        return await self.__call(self.api.get_projection_status, projection_id)
+
+    async def get_table_structure_columns(self, table_structure_id: int) -> list[dict]:
+        return await self.__call(self.api.get_table_structure_columns, table_structure_id)
+
+    async def get_table_structure_id(self, model_id: int, table_structure_name: str) -> int:
+        return await self.__call(self.api.get_table_structure_id, model_id, table_structure_name)
+
+    async def get_projection_template_id(self, model_id: int, template_name: str) -> int:
+        return await self.__call(self.api.get_projection_template_id, model_id, template_name)
+
+    async def is_projection_running(self, projection_id) -> bool:
+        return await self.__call(self.api.is_projection_running, projection_id)
+
+    async def list_data_tables(self, model_id: int) -> list[dict]:
+        return await self.__call(self.api.list_data_tables, model_id)
+
+    async def list_data_tables_by_structure_name(self, model_id: int, table_structure_name: str) -> list[dict]:
+        return await self.__call(self.api.list_data_tables_by_structure_name, model_id, table_structure_name)
+
+    async def list_data_tables_by_structure_id(self, table_structure_id: int) -> list[dict]:
+        return await self.__call(self.api.list_data_tables_by_structure_id, table_structure_id)
+
+    async def list_decrement_tables(self, model_id: int) -> list[dict]:
+        return await self.__call(self.api.list_decrement_tables, model_id)
+
+    async def list_projection_templates(self, model_id: int) -> list[dict]:
+        return await self.__call(self.api.list_projection_templates, model_id)
+
+    async def list_table_structures(self, model_id: int) -> list[dict]:
+        return await self.__call(self.api.list_table_structures, model_id)
+
+    async def run_projection(self, projection_id):
+        await self.__call(self.api.run_projection, projection_id)
+
+    async def update_projection(self, projection_id, properties):
+        await self.__call(self.api.update_projection, projection_id, properties)
+
+    async def update_projection_mpf(self, projection_id, portfolio_name, product_name, model_point_file_id):
+        await self.__call(self.api.update_projection_mpf, projection_id, portfolio_name, product_name, model_point_file_id)
+
+    async def update_projection_table(self, projection_id, table_name, data_table_id):
+        await self.__call(self.api.update_projection_table, projection_id, table_name, data_table_id)
+
+    # Wait until a projection has completed running. Returns the final status details of the projection.
+    # Uses the API's shared ProjectionWatcher, so no thread is held while waiting.
+    async def wait_for_completion(self, projection_id, expected_runtime: float = None) -> dict:
+        return await asyncio.wrap_future(self.api.projection_watcher.watch(projection_id, expected_runtime))
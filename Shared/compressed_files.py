@@ -0,0 +1,55 @@
+import gzip
+import io
+
+# zstandard is only needed when files are stored with zstd compression
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# File extension of each supported compression
+compression_extensions = {"gzip": ".gz", "zstd": ".zst"}
+
+gzip_level = 6      # Favour speed over size - reports are written once and read a few times
+zstd_level = 3
+
+
+# Raise an error if a compression is not supported in this environment
+def check_compression(compression: str):
+    if compression is None:
+        return
+    if compression not in compression_extensions:
+        raise ValueError(f"Unknown compression '{compression}'. Use 'gzip' or 'zstd'.")
+    if compression == "zstd" and zstandard is None:
+        raise ImportError("zstandard is required for zstd compression. Install it with 'uv add zstandard'.")
+
+
+# Open a file in binary mode ("rb" or "wb"), compressing or decompressing it on the fly
+def open_file(filename: str, mode: str, compression: str = None):
+    check_compression(compression)
+    if compression is None:
+        return open(filename, mode)
+    if compression == "gzip":
+        return gzip.open(filename, mode, compresslevel=gzip_level)
+    if mode == "rb":
+        # Buffer the zstd reader so it can be read line by line like the other formats
+        return io.BufferedReader(zstandard.open(filename, mode))
+    return zstandard.open(filename, mode, cctx=zstandard.ZstdCompressor(level=zstd_level))
+
+
+# Wrap an open binary file so that everything written to the wrapper is compressed into it
+# Closing the wrapper finishes the compressed stream (a new gzip member / zstd frame) but leaves fileobj open.
+# Concatenated gzip members and zstd frames decompress as the concatenation of their contents.
+def compress_into(fileobj, compression: str):
+    check_compression(compression)
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=gzip_level)
+    return zstandard.ZstdCompressor(level=zstd_level).stream_writer(fileobj, closefd=False)
+
+
+# Filename with the compression extension removed
+def strip_extension(filename: str, compression: str = None) -> str:
+    extension = compression_extensions.get(compression, "")
+    if extension and filename.endswith(extension):
+        return filename[:-len(extension)]
+    return filename
@@ -0,0 +1,139 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+
+
+# Tracks many running projections from a single background thread
+# Each watched projection gets a Future that completes with its final details ({"status": ..., "isRunning": False})
+# as soon as the projection stops running. Only the status fields are requested on each check.
+# The poll interval adapts to how long the projection is expected to run: checks are spaced out early in the run
+# and tighten as the expected finish time approaches. When no expected runtime is given, the average runtime of
+# projections already seen by this watcher is used instead.
+class ProjectionWatcher:
+    min_poll_interval = 5           # Seconds
+    max_poll_interval = 60          # Seconds
+    max_consecutive_errors = 5      # Number of failed status checks in a row before the projection's Future fails
+
+    # api - SlopeApi instance used for status checks
+    def __init__(self, api):
+        self.api = api
+        self.__watched = {}
+        self.__condition = threading.Condition()
+        self.__thread = None
+        self.__average_runtime = None
+
+    # Start watching a projection. Returns a Future that completes with the projection's final status details.
+    # expected_runtime (optional) - How long the projection is expected to run for, in seconds
+    # callback (optional) - Called with the Future once the projection completes
+    def watch(self, projection_id, expected_runtime: float = None, callback=None) -> Future:
+        with self.__condition:
+            entry = self.__watched.get(projection_id)
+            if entry is None:
+                now = time.time()
+                entry = {
+                    "future": Future(),
+                    "started": now,
+                    "next_check": now,
+                    "expected_runtime": expected_runtime,
+                    "errors": 0
+                }
+                self.__watched[projection_id] = entry
+            elif expected_runtime is not None:
+                entry["expected_runtime"] = expected_runtime
+
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run, name="ProjectionWatcher", daemon=True)
+                self.__thread.start()
+            self.__condition.notify()
+
+        if callback is not None:
+            entry["future"].add_done_callback(callback)
+        return entry["future"]
+
+    # Wait for a projection to finish and return its final status details
+    def wait(self, projection_id, expected_runtime: float = None) -> dict:
+        return self.watch(projection_id, expected_runtime).result()
+
+    # Stop watching a projection. Its Future is cancelled if it has not completed yet.
+    def unwatch(self, projection_id):
+        with self.__condition:
+            entry = self.__watched.pop(projection_id, None)
+        if entry is not None:
+            entry["future"].cancel()
+
+    def __poll_interval(self, entry: dict, now: float) -> float:
+        elapsed = now - entry["started"]
+        expected_runtime = entry["expected_runtime"] or self.__average_runtime
+        if expected_runtime is not None:
+            # Check a few times over the remaining expected runtime, then poll quickly once it is overdue
+            interval = (expected_runtime - elapsed) / 4
+        else:
+            # Nothing known about this projection yet - back off as it keeps running
+            interval = elapsed / 10
+        return min(max(interval, self.min_poll_interval), self.max_poll_interval)
+
+    def __record_runtime(self, runtime: float):
+        if self.__average_runtime is None:
+            self.__average_runtime = runtime
+        else:
+            self.__average_runtime = 0.7 * self.__average_runtime + 0.3 * runtime
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                if len(self.__watched) == 0:
+                    self.__thread = None
+                    return
+                now = time.time()
+                due = [projection_id for projection_id, entry in self.__watched.items() if entry["next_check"] <= now]
+                if len(due) == 0:
+                    next_check = min(entry["next_check"] for entry in self.__watched.values())
+                    self.__condition.wait(timeout=next_check - now)
+                    continue
+
+            for projection_id in due:
+                self.__check(projection_id)
+
+    def __check(self, projection_id):
+        with self.__condition:
+            entry = self.__watched.get(projection_id)
+        if entry is None:
+            return
+
+        try:
+            details = self.api.get_projection_details(projection_id, ["status", "isRunning"])
+        except Exception as e:
+            entry["errors"] += 1
+            logging.warning(f"Could not get status of Projection ID {projection_id}: {e}")
+            if entry["errors"] >= self.max_consecutive_errors:
+                with self.__condition:
+                    self.__watched.pop(projection_id, None)
+                self.__complete(entry["future"], exception=e)
+            else:
+                entry["next_check"] = time.time() + self.__poll_interval(entry, time.time())
+            return
+
+        entry["errors"] = 0
+        now = time.time()
+        if details.get("isRunning"):
+            entry["next_check"] = now + self.__poll_interval(entry, now)
+            logging.info(f"Waiting for Projection ID {projection_id} to finish. Current status: {details.get('status')}")
+            return
+
+        with self.__condition:
+            self.__watched.pop(projection_id, None)
+            self.__record_runtime(now - entry["started"])
+        logging.info(f"Projection ID {projection_id} finished with status: {details.get('status')}")
+        self.__complete(entry["future"], result=details)
+
+    # Set the outcome of a Future unless it was cancelled (unwatched) while its status was being checked
+    @staticmethod
+    def __complete(future: Future, result=None, exception: Exception = None):
+        try:
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+        except InvalidStateError:
+            pass
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+
+
+# Local disk cache of downloaded Sigma reports
+# Entries are keyed by a hash of the workbook, element, resolved filter parameters and batch size, so a report
+# requested with the same inputs is only downloaded once. Results of a completed projection never change, so
+# entries do not expire - the least recently used entries are removed once the cache grows past max_size_bytes.
+class ReportCache:
+    def __init__(self, cache_directory: str, max_size_bytes: int = 10 * 1024 ** 3):
+        self.cache_directory = cache_directory
+        self.max_size_bytes = max_size_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.__lock = threading.Lock()
+
+        if not os.path.exists(self.cache_directory):
+            os.makedirs(self.cache_directory)
+
+    # Build the cache key for a report request
+    @staticmethod
+    def make_key(workbook_id: str, element_id: str, report_params: dict, row_batch_size: int, compression: str = None) -> str:
+        request = {
+            "workbook": workbook_id,
+            "element": element_id,
+            "parameters": {str(key): str(value) for key, value in report_params.items()},
+            "row_batch_size": row_batch_size
+        }
+        # Compressed reports are stored compressed - only added to the key when set, so existing entries keep their keys
+        if compression is not None:
+            request["compression"] = compression
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def __data_path(self, key: str) -> str:
+        return os.path.join(self.cache_directory, f"{key}.csv")
+
+    def __metadata_path(self, key: str) -> str:
+        return os.path.join(self.cache_directory, f"{key}.json")
+
+    # Copy a cached report to filename
+    # Returns the metadata stored with the report, or None if the report is not in the cache
+    def get(self, key: str, filename: str):
+        with self.__lock:
+            data_path = self.__data_path(key)
+            metadata_path = self.__metadata_path(key)
+            if not os.path.exists(data_path) or not os.path.exists(metadata_path):
+                self.misses += 1
+                return None
+
+            with open(metadata_path, "r") as file:
+                metadata = json.load(file)
+
+            # Mark the entry as recently used
+            os.utime(data_path)
+            self.hits += 1
+
+        # Copy rather than link - callers are allowed to overwrite the file they were given
+        shutil.copyfile(data_path, filename)
+        logging.debug(f"Report cache hit for '{filename}' ({key})")
+        return metadata
+
+    # Store a copy of a downloaded report along with its metadata
+    def put(self, key: str, filename: str, metadata: dict):
+        data_path = self.__data_path(key)
+        temp_path = f"{data_path}.{threading.get_ident()}.tmp"
+        shutil.copyfile(filename, temp_path)
+
+        with self.__lock:
+            os.replace(temp_path, data_path)
+            with open(self.__metadata_path(key), "w") as file:
+                json.dump(metadata, file)
+            self.stores += 1
+            logging.debug(f"Stored '{filename}' in report cache ({key})")
+            self.__evict()
+
+    # Remove a single report from the cache
+    def invalidate(self, key: str):
+        with self.__lock:
+            for path in (self.__data_path(key), self.__metadata_path(key)):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    # Remove the least recently used reports until the cache fits within max_size_bytes
+    def __evict(self):
+        entries = []
+        total_size = 0
+        for entry in os.scandir(self.cache_directory):
+            if entry.is_file() and entry.name.endswith(".csv"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.name[:-len(".csv")]))
+                total_size += stat.st_size
+
+        entries.sort()
+        for _, size, key in entries:
+            if total_size <= self.max_size_bytes:
+                break
+            logging.debug(f"Evicting report {key} from report cache")
+            for path in (self.__data_path(key), self.__metadata_path(key)):
+                if os.path.exists(path):
+                    os.remove(path)
+            total_size -= size
+            self.evictions += 1
+
+    def get_statistics(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests > 0 else 0,
+            "stores": self.stores,
+            "evictions": self.evictions
+        }
@@ -0,0 +1,114 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+
+
+# Submits Sigma workbook report generations and polls all of them from a single background thread
+# Each submitted report gets a Future that completes with its download URL as soon as generation finishes, so
+# callers can start many generations up front and download each one as it becomes ready.
+# The first status check for a report is timed from the average generation time observed so far, then checks
+# back off by backoff_factor between min_poll_interval and max_poll_interval.
+class ReportScheduler:
+    min_poll_interval = 0.5         # Seconds
+    max_poll_interval = 10          # Seconds
+    backoff_factor = 1.5
+
+    # api - SlopeApi instance used to generate reports and check their status
+    def __init__(self, api):
+        self.api = api
+        self.__pending = {}
+        self.__condition = threading.Condition()
+        self.__thread = None
+        self.__average_generation_time = None
+
+    # Start generating a report. Returns a Future that completes with the report's download URL.
+    def submit(self, workbook_id: str, element_id: str, format_type: str, parameters: dict, row_limit: int = None, offset: int = None, timeout: float = 900) -> Future:
+        report_response = self.api.generate_workbook_report(
+            workbook_id=workbook_id,
+            element_id=element_id,
+            format_type=format_type,
+            parameters=parameters,
+            row_limit=row_limit,
+            offset=offset
+        )
+        generation_id = report_response["generationId"]
+        logging.debug(f"Report generation started with ID: {generation_id}")
+
+        now = time.time()
+        first_check = self.min_poll_interval
+        if self.__average_generation_time is not None:
+            first_check = min(max(self.__average_generation_time * 0.8, self.min_poll_interval), self.max_poll_interval)
+        entry = {
+            "future": Future(),
+            "submitted": now,
+            "next_check": now + first_check,
+            "interval": first_check,
+            "timeout": timeout
+        }
+
+        with self.__condition:
+            self.__pending[generation_id] = entry
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run, name="ReportScheduler", daemon=True)
+                self.__thread.start()
+            self.__condition.notify()
+
+        return entry["future"]
+
+    def __record_generation_time(self, generation_time: float):
+        if self.__average_generation_time is None:
+            self.__average_generation_time = generation_time
+        else:
+            self.__average_generation_time = 0.7 * self.__average_generation_time + 0.3 * generation_time
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                if len(self.__pending) == 0:
+                    self.__thread = None
+                    return
+                now = time.time()
+                due = [generation_id for generation_id, entry in self.__pending.items() if entry["next_check"] <= now]
+                if len(due) == 0:
+                    next_check = min(entry["next_check"] for entry in self.__pending.values())
+                    self.__condition.wait(timeout=next_check - now)
+                    continue
+
+            for generation_id in due:
+                self.__check(generation_id)
+
+    def __check(self, generation_id: str):
+        with self.__condition:
+            entry = self.__pending.get(generation_id)
+
+        try:
+            status_response = self.api.get_workbook_report_status(generation_id)
+        except Exception as e:
+            self.__finish(generation_id, exception=e)
+            return
+
+        now = time.time()
+        if status_response["status"] == "Completed":
+            with self.__condition:
+                self.__record_generation_time(now - entry["submitted"])
+            self.__finish(generation_id, result=status_response["downloadUrl"])
+        elif status_response["status"] == "Failed":
+            self.__finish(generation_id, exception=Exception(f"Report generation failed: {status_response.get('message', 'Unknown error')}"))
+        elif now - entry["submitted"] > entry["timeout"]:
+            self.__finish(generation_id, exception=TimeoutError(f"Report generation did not complete within {entry['timeout']} seconds."))
+        else:
+            entry["interval"] = min(entry["interval"] * self.backoff_factor, self.max_poll_interval)
+            entry["next_check"] = now + entry["interval"]
+
+    def __finish(self, generation_id: str, result: str = None, exception: Exception = None):
+        with self.__condition:
+            entry = self.__pending.pop(generation_id)
+        try:
+            if exception is not None:
+                entry["future"].set_exception(exception)
+            else:
+                entry["future"].set_result(result)
+        except InvalidStateError:
+            # The caller cancelled this report
+            pass
@@ -1,13 +1,30 @@
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from queue import Queue
 import logging
 import os
 import pandas as pd
+from Shared.compressed_files import check_compression, compress_into, compression_extensions, open_file, strip_extension
+from Shared.report_cache import ReportCache
 from Shared.slope_api import SlopeApi
-from typing import Any, Dict
+from typing import Any, Dict, List
 import csv
+import itertools
 import uuid
 
+# pyarrow is only needed when reports are stored in a columnar format (see SigmaReportParams.storage_format)
+try:
+    import pyarrow
+    import pyarrow.csv
+    import pyarrow.feather
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# File extension of each supported columnar storage format
+columnar_extensions = {"parquet": ".parquet", "feather": ".arrow"}
+
 @dataclass
 class SigmaReportParams:
     workbook_id: str
@@ -15,6 +32,18 @@ class SigmaReportParams:
     filter_params: Dict[str, str]
     working_directory: str = r'C:\\Slope API'
     row_batch_size: int = 1000000
+    max_concurrent_segments: int = 1    # Number of report segments generated and downloaded at the same time
+    cache: bool = True                  # Set to False for reports whose results can still change, so they are never served from the report cache
+    storage_format: str = "csv"         # "parquet" or "feather" (Arrow IPC) also converts the report to a columnar file once it is downloaded. Requires pyarrow.
+    # Column types applied when the report is loaded by get_data. Without any of these, pandas infers every type.
+    dtypes: Dict[str, str] = None                   # Column name -> pandas dtype (e.g. "int32", "float64", "string")
+    categorical_columns: List[str] = None           # Columns with few distinct values, loaded as categoricals
+    date_columns: List[str] = None                  # Columns parsed as dates
+    usecols: List[str] = None                       # Only load these columns
+    compression: str = None             # "gzip" or "zstd" to store the downloaded report compressed on disk. zstd requires zstandard.
+    # Filter name -> report column holding the value it filters on (e.g. {"Pivot-Time-Index": "Pivot Time Index"})
+    # A report can be retrieved once without a declared filter and split on its column instead of once per filter value
+    filter_columns: Dict[str, str] = None
 
     @staticmethod
     def from_dict(obj: Any) -> 'SigmaReportParams':
@@ -22,19 +51,112 @@ class SigmaReportParams:
         _element = str(obj.get("element"))
         _filters = obj.get("filters")
         _row_batch_size = int(obj.get("row_batch_size", 1000000))
-        return SigmaReportParams(_workbook, _element, _filters, row_batch_size=_row_batch_size)
+        _max_concurrent_segments = int(obj.get("max_concurrent_segments", 1))
+        _cache = bool(obj.get("cache", True))
+        _storage_format = str(obj.get("storage_format", "csv")).lower()
+        _dtypes = obj.get("dtypes")
+        _categorical_columns = obj.get("categorical_columns")
+        _date_columns = obj.get("date_columns")
+        _usecols = obj.get("usecols")
+        _compression = obj.get("compression")
+        _filter_columns = obj.get("filter_columns")
+        return SigmaReportParams(_workbook, _element, _filters, row_batch_size=_row_batch_size,
+                                 max_concurrent_segments=_max_concurrent_segments, cache=_cache, storage_format=_storage_format,
+                                 dtypes=_dtypes, categorical_columns=_categorical_columns, date_columns=_date_columns, usecols=_usecols,
+                                 compression=_compression, filter_columns=_filter_columns)
+
+# Collects row count, byte count and header of a CSV file from the chunks of bytes as they are downloaded
+# Line breaks inside quoted values are not counted as new rows, matching what csv.reader would count
+class CsvSegmentStats:
+    def __init__(self):
+        self.bytes = 0
+        self.header: list[str] = None
+        self.header_bytes = 0       # Length of the header line (including the line break) in bytes
+        self.__line_breaks = 0
+        self.__in_quotes = False
+        self.__last_byte = b''
+        self.__head = bytearray()
+
+    def update(self, chunk: bytes):
+        if not chunk:
+            return
+
+        # Splitting on quote characters gives alternating pieces outside/inside quoted values
+        # Escaped quotes ("") toggle twice, so they leave the quote state unchanged
+        position = self.bytes
+        for i, piece in enumerate(chunk.split(b'"')):
+            if i > 0:
+                self.__in_quotes = not self.__in_quotes
+                position += 1
+            if not self.__in_quotes:
+                line_breaks = piece.count(b'\n')
+                if line_breaks and self.header_bytes == 0:
+                    self.header_bytes = position + piece.index(b'\n') + 1
+                self.__line_breaks += line_breaks
+            position += len(piece)
+
+        if self.header is None:
+            self.__head += chunk
+            if self.header_bytes > 0:
+                self.__set_header(bytes(self.__head[:self.header_bytes]))
+                self.__head = bytearray()
+
+        self.bytes += len(chunk)
+        self.__last_byte = chunk[-1:]
+
+    @property
+    def ends_with_line_break(self) -> bool:
+        return self.__last_byte == b'\n'
+
+    def __set_header(self, header_line: bytes):
+        self.header = next(csv.reader([header_line.decode('utf-8-sig')]), [])
+
+    # Number of data rows (excluding the header row)
+    @property
+    def rows(self) -> int:
+        records = self.__line_breaks
+        if self.bytes > 0 and self.__last_byte != b'\n':
+            records += 1  # Last row has no trailing line break
+        return max(records - 1, 0)
+
+    # Call once the download has finished to pick up a header that has no trailing line break
+    def finish(self):
+        if self.header is None and self.__head:
+            self.header_bytes = len(self.__head)
+            self.__set_header(bytes(self.__head))
+            self.__head = bytearray()
+
 
 class SigmaReport:
     __filename: str = None
+    __columnar_filename: str = None
     __data: pd.DataFrame = None
+    copy_buffer_size = 16777216     # Bytes copied at a time when combining segments without OS copy support
+    columnar_block_size = 67108864  # Bytes of CSV converted at a time to the columnar format. Column types are inferred from the first block.
 
-    def __init__(self, api: SlopeApi, params: SigmaReportParams, filepath: str = None):
+    # cache (optional) - Report cache used to skip downloading reports that have already been retrieved with the same filters
+    def __init__(self, api: SlopeApi, params: SigmaReportParams, filepath: str = None, cache: ReportCache = None):
         self.api = api
+        self.cache = cache if params.cache else None
         self.working_directory = params.working_directory + "\\Reports"
         self.workbook_id = params.workbook_id
         self.element_id = params.element_id
         self.filters = params.filter_params
         self.row_batch_size = params.row_batch_size
+        self.max_concurrent_segments = max(1, params.max_concurrent_segments)
+        self.storage_format = params.storage_format
+        self.dtypes = params.dtypes or {}
+        self.categorical_columns = params.categorical_columns or []
+        self.date_columns = params.date_columns
+        self.usecols = params.usecols
+        self.compression = params.compression
+        check_compression(self.compression)
+
+        if self.storage_format != "csv":
+            if self.storage_format not in columnar_extensions:
+                raise ValueError(f"Unknown report storage format '{self.storage_format}'. Use 'csv', 'parquet' or 'feather'.")
+            if pyarrow is None:
+                raise ImportError(f"pyarrow is required to store reports as {self.storage_format}. Install it with 'uv add pyarrow'.")
 
         if filepath is not None:
             self.working_directory = filepath
@@ -42,22 +164,80 @@ class SigmaReport:
         if not os.path.exists(self.working_directory):
             os.makedirs(self.working_directory)
 
+        # Metadata (filename, offset, rows, bytes, header) of each segment downloaded by the last call to retrieve()
+        self.segments: list[dict] = []
+
+    # Combine report segments into a single CSV file by copying raw bytes
+    # The first segment is copied as is, later segments are copied from just after their header line
+    # Nothing is parsed - the header length comes from the segment metadata collected during the download
+    # Compressed segments are combined the same way: the first segment's compressed bytes are copied as is, and each
+    # later segment is decompressed, has its header skipped and is appended as a new gzip member / zstd frame
     @staticmethod
-    def __combine_csv_segments(segments: list, output_filename: str):
+    def __combine_csv_segments(segments: list[dict], output_filename: str, compression: str = None):
         logging.debug(f"Combining {len(segments)} CSV segments into {output_filename}")
-        with open(output_filename, 'w', newline='', encoding='utf-8') as outfile:
-            writer = csv.writer(outfile)
-            header_written = False
-            for segment in segments:
-                with open(segment, 'r', encoding='utf-8') as infile:
-                    reader = csv.reader(infile)
-                    header = next(reader)
-                    if not header_written:
-                        writer.writerow(header)
-                        header_written = True
-                    for row in reader:
-                        writer.writerow(row)
-                os.remove(segment)
+        header = segments[0]["header"]
+        with open(output_filename, 'wb') as outfile:
+            ends_with_line_break = True
+            for i, segment in enumerate(segments):
+                if segment["header"] != header:
+                    raise ValueError(f"Report segment '{segment['filename']}' columns {segment['header']} do not match {header}")
+
+                start = 0 if i == 0 else segment["header_bytes"]
+                length = segment["bytes"] - start
+                if length > 0 and compression is None:
+                    if not ends_with_line_break:
+                        outfile.write(b'\n')
+                    with open(segment["filename"], 'rb') as infile:
+                        SigmaReport.__copy_bytes(infile, outfile, start, length)
+                        infile.seek(segment["bytes"] - 1)
+                        ends_with_line_break = infile.read(1) == b'\n'
+                elif length > 0 and i == 0:
+                    with open(segment["filename"], 'rb') as infile:
+                        SigmaReport.__copy_bytes(infile, outfile, 0, os.path.getsize(segment["filename"]))
+                    ends_with_line_break = segment.get("ends_with_line_break", True)
+                elif length > 0:
+                    with open_file(segment["filename"], 'rb', compression) as infile, compress_into(outfile, compression) as writer:
+                        if not ends_with_line_break:
+                            writer.write(b'\n')
+                        infile.read(start)
+                        while chunk := infile.read(SigmaReport.copy_buffer_size):
+                            writer.write(chunk)
+                    ends_with_line_break = segment.get("ends_with_line_break", True)
+                os.remove(segment["filename"])
+
+    # Copy length bytes from infile (starting at offset) to the current position of outfile
+    # Uses the OS to copy between files without passing the data through Python when possible
+    @staticmethod
+    def __copy_bytes(infile, outfile, offset: int, length: int):
+        outfile.flush()
+        remaining = length
+        for copy_function in ("copy_file_range", "sendfile"):
+            if not hasattr(os, copy_function):
+                continue
+            try:
+                while remaining > 0:
+                    if copy_function == "copy_file_range":
+                        copied = os.copy_file_range(infile.fileno(), outfile.fileno(), remaining, offset + length - remaining)
+                    else:
+                        copied = os.sendfile(outfile.fileno(), infile.fileno(), offset + length - remaining, remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+                outfile.seek(0, os.SEEK_END)
+                if remaining == 0:
+                    return
+            except OSError:
+                # Not supported between these files (e.g. different file systems on older kernels) - try the next method
+                outfile.seek(0, os.SEEK_END)
+
+        # Fall back to a buffered copy
+        infile.seek(offset + length - remaining)
+        while remaining > 0:
+            buffer = infile.read(min(SigmaReport.copy_buffer_size, remaining))
+            if not buffer:
+                raise IOError(f"Report segment '{infile.name}' is shorter than expected.")
+            outfile.write(buffer)
+            remaining -= len(buffer)
 
     def __get_report_params(self, filter_values: dict):
         report_params = {}
@@ -71,61 +251,292 @@ class SigmaReport:
 
         return report_params
     
-    def get_data(self) -> pd.DataFrame:
-        if self.__data is None:
-            if self.__filename is None:
-                raise ValueError("Report data has not been retrieved yet. Call retrieve() first.")
-            else:
-                self.__data = pd.read_csv(self.__filename, parse_dates=True)
+    # columns (optional) - Only load these columns instead of the report's usecols. The result is not kept, so each call reads the file again.
+    # Declared dtypes, categorical columns and date columns are applied as the file is read
+    # Columnar reports are memory-mapped and only the requested columns are read from disk
+    def get_data(self, columns: list[str] = None) -> pd.DataFrame:
+        if self.__filename is None:
+            raise ValueError("Report data has not been retrieved yet. Call retrieve() first.")
+        if columns is not None:
+            return self.__read_data(columns)
 
+        if self.__data is None:
+            self.__data = self.__read_data()
         return self.__data
+
+    # Yield the report as DataFrames of up to rows rows each, without loading the whole report into memory
+    # Declared dtypes, categorical columns and date columns are applied to every batch.
+    # Categorical columns only hold the categories that appear in their own batch.
+    def iter_batches(self, rows: int = 100000, columns: list[str] = None):
+        return self.__iter_frames(itertools.repeat(rows), columns)
+
+    # Yield the report one downloaded segment at a time (up to row_batch_size rows each), in offset order
+    def iter_segments(self, columns: list[str] = None):
+        return self.__iter_frames([segment["rows"] for segment in self.segments if segment["rows"] > 0], columns)
+
+    # Columns, dtypes and date columns to read, after applying the report's declarations
+    def __read_options(self, columns: list[str] = None) -> tuple[list[str], dict, list[str]]:
+        columns = columns if columns is not None else self.usecols
+        dtypes = dict(self.dtypes)
+        dtypes.update({column: "category" for column in self.categorical_columns})
+        date_columns = self.date_columns
+        if columns is not None:
+            dtypes = {column: dtype for column, dtype in dtypes.items() if column in columns}
+            if date_columns is not None:
+                date_columns = [column for column in date_columns if column in columns]
+        return columns, dtypes, date_columns
+
+    def __read_csv(self, columns: list[str] = None, iterator: bool = False):
+        columns, dtypes, date_columns = self.__read_options(columns)
+        # Only let pandas look for dates everywhere when nothing about the report's columns has been declared
+        if date_columns is None:
+            date_columns = len(dtypes) == 0 and self.usecols is None
+        return pd.read_csv(self.__filename, usecols=columns, dtype=dtypes or None, parse_dates=date_columns, iterator=iterator,
+                           compression=self.compression)
+
+    # usecols keeps the file's column order - return the columns in the order they were asked for
+    def __select_columns(self, data: pd.DataFrame, columns: list[str] = None) -> pd.DataFrame:
+        columns = columns if columns is not None else self.usecols
+        return data if columns is None else data[columns]
+
+    @staticmethod
+    def __apply_types(data: pd.DataFrame, dtypes: dict, date_columns: list[str]) -> pd.DataFrame:
+        dtypes = {column: dtype for column, dtype in dtypes.items() if column in data.columns}
+        if len(dtypes) > 0:
+            data = data.astype(dtypes)
+        for column in date_columns or []:
+            data[column] = pd.to_datetime(data[column])
+        return data
+
+    def __read_data(self, columns: list[str] = None) -> pd.DataFrame:
+        if self.__columnar_filename is None:
+            return self.__select_columns(self.__read_csv(columns), columns)
+
+        columns, dtypes, date_columns = self.__read_options(columns)
+        if self.storage_format == "parquet":
+            table = pyarrow.parquet.read_table(self.__columnar_filename, columns=columns, memory_map=True)
+        else:
+            table = pyarrow.feather.read_table(self.__columnar_filename, columns=columns, memory_map=True)
+        return SigmaReport.__apply_types(table.to_pandas(), dtypes, date_columns)
+
+    # Yield consecutive DataFrames with the number of rows given by sizes, until sizes or the report runs out
+    def __iter_frames(self, sizes, columns: list[str] = None):
+        if self.__filename is None:
+            raise ValueError("Report data has not been retrieved yet. Call retrieve() first.")
+
+        if self.__columnar_filename is None:
+            with self.__read_csv(columns, iterator=True) as reader:
+                for size in sizes:
+                    try:
+                        frame = reader.get_chunk(size)
+                    except StopIteration:
+                        return
+                    yield self.__select_columns(frame, columns)
+            return
+
+        columns, dtypes, date_columns = self.__read_options(columns)
+        if self.storage_format == "parquet":
+            record_batches = pyarrow.parquet.ParquetFile(self.__columnar_filename, memory_map=True).iter_batches(columns=columns)
+        else:
+            record_batches = iter(pyarrow.feather.read_table(self.__columnar_filename, columns=columns, memory_map=True).to_batches())
+
+        # Regroup the file's record batches into frames of the requested sizes
+        pending = []
+        pending_rows = 0
+        for size in sizes:
+            while pending_rows < size:
+                record_batch = next(record_batches, None)
+                if record_batch is None:
+                    break
+                pending.append(record_batch)
+                pending_rows += record_batch.num_rows
+            if pending_rows == 0:
+                return
+            table = pyarrow.Table.from_batches(pending)
+            yield SigmaReport.__apply_types(table.slice(0, size).to_pandas(), dtypes, date_columns)
+            pending = table.slice(size).to_batches()
+            pending_rows = max(pending_rows - size, 0)
+
+    # Convert the downloaded CSV to the columnar storage format. The CSV is kept, as it is what gets uploaded back to SLOPE.
+    def __convert_to_columnar(self):
+        self.__columnar_filename = os.path.splitext(strip_extension(self.__filename, self.compression))[0] + columnar_extensions[self.storage_format]
+        if self.get_row_count() == 0:
+            # Nothing to infer column types from - empty reports are read from the CSV
+            self.__columnar_filename = None
+            return
+
+        # Dates are left as text and empty values are missing, the same as when the CSV is read by pandas
+        # The CSV is converted one block at a time, so the whole report is never held in memory
+        read_options = pyarrow.csv.ReadOptions(block_size=self.columnar_block_size)
+        convert_options = pyarrow.csv.ConvertOptions(timestamp_parsers=[], strings_can_be_null=True)
+        try:
+            with pyarrow.input_stream(self.__filename, compression=self.compression) as stream:
+                reader = pyarrow.csv.open_csv(stream, read_options=read_options, convert_options=convert_options)
+                if self.storage_format == "parquet":
+                    writer = pyarrow.parquet.ParquetWriter(self.__columnar_filename, reader.schema)
+                else:
+                    writer = pyarrow.ipc.new_file(self.__columnar_filename, reader.schema)
+                with writer:
+                    for record_batch in reader:
+                        writer.write_batch(record_batch)
+        except pyarrow.ArrowInvalid as e:
+            # A later block does not match the column types inferred from the first one - read the report from the CSV instead
+            logging.warning(f"Could not convert report '{self.__filename}' to {self.storage_format}, it will be read from the CSV: {e}")
+            if os.path.exists(self.__columnar_filename):
+                os.remove(self.__columnar_filename)
+            self.__columnar_filename = None
+            return
+        logging.debug(f"Converted report '{self.__filename}' to {self.storage_format} '{self.__columnar_filename}'")
+
+    # Name of the columnar copy of the last retrieved report, or None if it is only stored as CSV
+    def get_columnar_filename(self) -> str:
+        return self.__columnar_filename
         
+    # Total number of data rows in the last retrieved report
+    def get_row_count(self) -> int:
+        return sum(segment["rows"] for segment in self.segments)
+
+    # Total number of bytes downloaded for the last retrieved report
+    def get_byte_count(self) -> int:
+        return sum(segment["bytes"] for segment in self.segments)
+
+    # Column names of the last retrieved report
+    def get_header(self) -> list[str]:
+        if len(self.segments) == 0:
+            raise ValueError("Report data has not been retrieved yet. Call retrieve() first.")
+        return self.segments[0]["header"]
+
+    # Name of the downloaded report file. When compression is set, the file is compressed and ends in .gz or .zst
     def get_filename(self) -> str:  
         if self.__filename is None:
             raise ValueError("Report data has not been retrieved yet. Call retrieve() first.")
         return self.__filename
+
+    # Delete the files of the last retrieved report (the report cache keeps its own copy)
+    def cleanup(self):
+        for filename in (self.__filename, self.__columnar_filename):
+            if filename is not None and os.path.exists(filename):
+                os.remove(filename)
+        self.__data = None
+        self.__filename = None
+        self.__columnar_filename = None
     
-    def retrieve(self, filter_values: dict, filename: str = None):
-        num_segments = 0
-        offset = 0
-        row_count = self.row_batch_size
+    # Download a single report segment and return its metadata
+    # Rows, bytes and header are collected from the download stream as it is written, so the file is never re-read
+    def __download_segment(self, report_params: dict, segment_filename: str, offset: int) -> dict:
+        logging.debug(f"Downloading report segment '{segment_filename}' for workbook {self.workbook_id}, element {self.element_id}, offset {offset}")
+        stats = CsvSegmentStats()
+        self.api.download_report(self.workbook_id, self.element_id, segment_filename, "Csv", report_params,
+                                 row_limit=self.row_batch_size, offset=offset, chunk_handler=stats.update, compression=self.compression)
+        stats.finish()
+        return {
+            "filename": segment_filename,
+            "offset": offset,
+            "rows": stats.rows,
+            "bytes": stats.bytes,
+            "header": stats.header,
+            "header_bytes": stats.header_bytes,
+            "ends_with_line_break": stats.ends_with_line_break
+        }
+
+    def __segment_filename(self, segment_num: int, unique_id: str) -> str:
+        return f'{self.working_directory}\\{self.workbook_id}_{self.element_id}_{segment_num}_{unique_id}.csv{compression_extensions.get(self.compression, "")}'
+
+    # Download report segments until one comes back with fewer rows than the batch size
+    # The first segment is downloaded on its own, so reports that fit in a single segment only generate one.
+    # Once it comes back full, the total row count is still not known, so up to max_concurrent_segments offsets are requested speculatively.
+    # Segments are always consumed in offset order. Once the last segment is found, any segments requested past the end are discarded.
+    # Returns the metadata of each segment in order
+    def __download_segments(self, report_params: dict, unique_id: str) -> list[dict]:
         report_segments = []
+        pending = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrent_segments, thread_name_prefix="SigmaSegment") as executor:
+            def submit(segment_num: int):
+                offset = (segment_num - 1) * self.row_batch_size
+                pending[segment_num] = executor.submit(self.__download_segment, report_params, self.__segment_filename(segment_num, unique_id), offset)
+
+            submit(1)
+            next_segment_num = 2
 
+            segment_num = 1
+            try:
+                while True:
+                    segment = pending.pop(segment_num).result()
+                    report_segments.append(segment)
+                    if segment["rows"] < self.row_batch_size:
+                        break
+                    segment_num += 1
+                    # Keep max_concurrent_segments segments in flight from the next one needed
+                    while next_segment_num < segment_num + self.max_concurrent_segments:
+                        submit(next_segment_num)
+                        next_segment_num += 1
+            finally:
+                # Discard any segments that were requested past the end of the report (or after a failure)
+                for discard_num, future in pending.items():
+                    if not future.cancel():
+                        try:
+                            future.result()
+                        except Exception as e:
+                            logging.debug(f"Ignoring error on discarded report segment {discard_num}: {e}")
+                    if os.path.exists(self.__segment_filename(discard_num, unique_id)):
+                        os.remove(self.__segment_filename(discard_num, unique_id))
+
+        return report_segments
+
+    # Retrieve several reports at the same time. Each request is a (report, filter_values) pair.
+    # Every report generation is submitted up front and the reports are downloaded as each one becomes ready.
+    @staticmethod
+    def retrieve_all(requests: list[tuple['SigmaReport', dict]], max_concurrent_reports: int = 8):
+        if len(requests) == 0:
+            return
+        with ThreadPoolExecutor(max_workers=min(max_concurrent_reports, len(requests)), thread_name_prefix="SigmaReport") as executor:
+            futures = [executor.submit(report.retrieve, filter_values) for report, filter_values in requests]
+            for future in futures:
+                future.result()
+
+    # use_cache - Set to False when the results may not be final yet (e.g. the projection is still loading results)
+    #             The report is always downloaded and is not stored in the cache
+    def retrieve(self, filter_values: dict, filename: str = None, use_cache: bool = True):
         unique_id = uuid.uuid4().hex
 
         self.__data = None  # Clear any existing data
+        self.__columnar_filename = None
 
         if filename is None:
-            self.__filename = f'{self.working_directory}\\{self.workbook_id}_{self.element_id}_{unique_id}.csv'
+            self.__filename = f'{self.working_directory}\\{self.workbook_id}_{self.element_id}_{unique_id}.csv{compression_extensions.get(self.compression, "")}'
         else:
             self.__filename = filename
 
         report_params = self.__get_report_params(filter_values)
 
-        while row_count >= self.row_batch_size:
-            num_segments += 1
-            
-            # Download the report segment
-            logging.debug(f"Downloading report segment {num_segments} for workbook {self.workbook_id}, element {self.element_id}, offset {offset}")
-            
-            segment_filename = f'{self.working_directory}\\{self.workbook_id}_{self.element_id}_{num_segments}_{unique_id}.csv'
-            self.api.download_report(self.workbook_id, self.element_id, segment_filename, "Csv", report_params, row_limit=self.row_batch_size, offset=offset)
-            report_segments.append(segment_filename)
-            
-            # Count how many rows were downloaded to see if we hit the limit
-            # TODO: See if API can return the row count in the response
-            with open(segment_filename, 'r', encoding='utf-8') as f:
-                reader = csv.reader(f)
-                row_count = sum(1 for _ in reader) - 1  # subtract 1 for header
-
-            offset += row_count
+        cache_key = None
+        if self.cache is not None and use_cache:
+            cache_key = ReportCache.make_key(self.workbook_id, self.element_id, report_params, self.row_batch_size, self.compression)
+            metadata = self.cache.get(cache_key, self.__filename)
+            if metadata is not None:
+                self.segments = metadata["segments"]
+                logging.info(f"Loaded report '{self.__filename}' from cache. It contains {self.get_row_count()} rows.")
+                if self.storage_format != "csv":
+                    self.__convert_to_columnar()
+                return
+
+        self.segments = self.__download_segments(report_params, unique_id)
+        report_segments = [segment["filename"] for segment in self.segments]
         
         if (len(report_segments) > 1):
-            self.__combine_csv_segments(report_segments, self.__filename)
+            self.__combine_csv_segments(self.segments, self.__filename, self.compression)
         else:
             # If only one segment, just rename it to the final filename
             if os.path.exists(self.__filename):
                 os.remove(self.__filename)
             os.rename(report_segments[0], self.__filename)
         
-        logging.info(f"Downloaded report '{self.__filename}' contains {row_count} rows.")
\ No newline at end of file
+        logging.info(f"Downloaded report '{self.__filename}' contains {self.get_row_count()} rows.")
+
+        # Empty reports are not cached - the results may not have been loaded yet
+        if cache_key is not None and self.get_row_count() > 0:
+            self.cache.put(cache_key, self.__filename, {"segments": self.segments})
+
+        if self.storage_format != "csv":
+            self.__convert_to_columnar()
\ No newline at end of file
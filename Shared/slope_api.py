@@ -4,27 +4,120 @@ import logging
 import time
 import threading
 import hashlib
+import base64
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from Shared.api_metrics import ApiMetrics
+from Shared.compressed_files import open_file
+from Shared.projection_watcher import ProjectionWatcher
+from Shared.report_scheduler import ReportScheduler
 from dateutil.parser import parse
+import numpy as np
 import pandas as pd
 from requests.adapters import HTTPAdapter
 from urllib3 import Retry
+from urllib3.util import make_headers
+
+
+# File wrapper that calculates the MD5 digest of the file while it is being read by an upload
+# Reports its length so requests sends a Content-Length header (presigned S3 uploads do not accept chunked transfers)
+# Supports rewinding to the start so a failed PUT can be retried - the digest restarts along with the file
+class _HashingFileReader:
+    def __init__(self, file):
+        self.__file = file
+        self.__length = os.fstat(file.fileno()).st_size
+        self.__hash = hashlib.md5()
+
+    def __len__(self) -> int:
+        return self.__length
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self.__file.read(size)
+        self.__hash.update(chunk)
+        return chunk
+
+    def tell(self) -> int:
+        return self.__file.tell()
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if offset != 0 or whence != os.SEEK_SET:
+            raise OSError("Uploads can only be rewound to the start of the file.")
+        self.__hash = hashlib.md5()
+        return self.__file.seek(0)
+
+    def hexdigest(self) -> str:
+        return self.__hash.hexdigest()
 
 
 class SlopeApi:
     api_url = "https://api.slopesoftware.com/api/v1"
-    __expires: datetime.datetime
-    __refresh_token = ""
-    __lock = threading.Lock()
-
-    def __init__(self):
+    token_refresh_ahead = 300             # The background refresher renews the auth token this many seconds before it expires
+    token_min_remaining = 60              # A request only refreshes the token itself if it has less than this many seconds left
+    token_refresh_attempts = 3            # Number of attempts at refreshing the auth token before giving up
+    download_chunk_size = 1048576         # Bytes read from the network and written to disk at a time when downloading files
+    download_log_interval = 104857600     # Log download progress every 100 MB
+    # Send a Content-MD5 header on uploads, so S3 rejects an upload that was corrupted in transit. The header has to be sent
+    # before the body, so this needs an extra read of the file before the upload starts. The file has normally just been
+    # written, so that read is served from the OS cache and costs far less than the upload itself.
+    upload_content_md5 = True
+    transfer_retries = 5                  # Retries of failed presigned upload/download calls (connection errors, throttling and 5xx responses)
+    transfer_backoff = 0.5                # Backoff factor in seconds between transfer retries
+    transfer_attempts = 3                 # Attempts at a download that drops part way through. Later attempts resume from the bytes already written.
+
+    # pool_size controls how many connections to the SLOPE API are kept open for reuse
+    # Increase this when many calls will be in flight at once (e.g. from AsyncSlopeApi)
+    # transfer_pool_size controls how many connections to the object store are kept open for concurrent uploads and downloads
+    # Model metadata (table structures, projection templates, table structure columns) is cached for metadata_ttl seconds
+    # metadata_cache_file (optional) - JSON file used to share cached metadata between processes and runs
+    def __init__(self, pool_size: int = 10, transfer_pool_size: int = 32, metadata_ttl: float = 3600, metadata_cache_file: str = None):
         self.session = requests.Session()
         retry = Retry(connect=3,
                       backoff_factor=1,
                       status_forcelist=[429, 500, 502, 503, 504])
-        adapter = HTTPAdapter(max_retries=retry)
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_size, pool_maxsize=pool_size)
         self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)        # Only used by local stand-in servers (see Benchmark)
         self.session.headers.update({"Content-type": "application/json"})
 
+        # Auth token state - only changed while holding the auth lock, but read without it on every request
+        self.__expires: datetime.datetime = None
+        self.__refresh_token = ""
+        self.__auth_lock = threading.Lock()
+        self.__stop_refresh = threading.Event()
+        self.__refresh_thread = None
+
+        # Separate session for direct transfers to and from the presigned S3 URLs
+        # These calls must not send the SLOPE auth header, but reuse pooled connections so every segment of a report
+        # does not pay for a new TLS handshake. GETs and PUTs to a presigned URL are idempotent, so both are retried.
+        self.transfer_session = requests.Session()
+        transfer_retry = Retry(total=self.transfer_retries,
+                               backoff_factor=self.transfer_backoff,
+                               status_forcelist=[429, 500, 502, 503, 504],
+                               allowed_methods=["GET", "HEAD", "PUT"],
+                               raise_on_status=False)
+        transfer_adapter = HTTPAdapter(max_retries=transfer_retry, pool_connections=4, pool_maxsize=transfer_pool_size)
+        self.transfer_session.mount('https://', transfer_adapter)
+        self.transfer_session.mount('http://', transfer_adapter)
+        # Accept every content encoding urllib3 can decode here (gzip and deflate, plus br/zstd when their packages are installed)
+        self.transfer_session.headers.update(make_headers(accept_encoding=True))
+
+        # Per-endpoint call statistics for both sessions
+        self.metrics = ApiMetrics(self.api_url)
+        self.session.hooks["response"].append(self.metrics.record_response)
+        self.transfer_session.hooks["response"].append(self.metrics.record_response)
+
+        self.metadata_ttl = metadata_ttl
+        self.metadata_cache_file = metadata_cache_file
+        self.__metadata = {}      # key -> [expiry time, value]
+        self.__metadata_lock = threading.Lock()
+        self.__load_metadata_cache()
+
+        # Single watcher shared by everything waiting on projections through this API instance
+        self.projection_watcher = ProjectionWatcher(self)
+        # Single scheduler that polls the status of every report being generated through this API instance
+        self.report_scheduler = ReportScheduler(self)
+
     @staticmethod
     def __check_response(response):
 
@@ -42,8 +135,9 @@ class SlopeApi:
         logging.debug(f"API Response: {response}")
 
     # Authenticate the API using API Key and API Secret
+    # Starts a background thread that keeps the auth token refreshed until close() is called
     def authorize(self, key: str, secret: str):
-        with self.__lock:
+        with self.__auth_lock:
             auth_params = {
                 "apiKey": key,
                 "apiSecretKey": secret
@@ -51,23 +145,59 @@ class SlopeApi:
             logging.debug(f"Authorizing SLOPE API with key '{key}' and secret '{secret}'")
             response = self.session.post(f"{self.api_url}/Authorize", json=auth_params)
             self.__check_response(response)
-            access_token = response.json()["accessToken"]
-            self.session.headers.update({"Authorization": f"Bearer {access_token}"})
-            self.__refresh_token = response.json()["refreshToken"]
-            self.__expires = parse(response.json()["expires"])
+            self.__set_token(response.json())
+
+        if self.__refresh_thread is None or not self.__refresh_thread.is_alive():
+            self.__stop_refresh.clear()
+            self.__refresh_thread = threading.Thread(target=self.__refresh_periodically, name="TokenRefresher", daemon=True)
+            self.__refresh_thread.start()
+
+    # Stop the background token refresher
+    def close(self):
+        self.__stop_refresh.set()
 
     # Refresh the API authentication session
     def refresh(self):
+        with self.__auth_lock:
+            self.__refresh()
+
+    # Refresh the auth token on the pooled session, retrying transient failures. Must be called while holding the auth lock.
+    def __refresh(self):
         logging.debug("Refreshing API auth token")
         refresh_params = {
             "refreshToken": self.__refresh_token
         }
-        response = requests.post(f"{self.api_url}/Authorize/Refresh", json=refresh_params, headers={"Content-Type": "application/json"})
-        self.__check_response(response)
-        access_token = response.json()["accessToken"]
-        self.session.headers.update({"Authorization": f"Bearer {access_token}"})
-        self.__refresh_token = response.json()["refreshToken"]
-        self.__expires = parse(response.json()["expires"])
+        for attempt in range(1, self.token_refresh_attempts + 1):
+            try:
+                # The refresh call is made without the (possibly expired) current token
+                response = self.session.post(f"{self.api_url}/Authorize/Refresh", json=refresh_params, headers={"Authorization": None})
+                self.__check_response(response)
+                break
+            except requests.RequestException as e:
+                retryable = not isinstance(e, requests.HTTPError) or e.response.status_code in [429, 500, 502, 503, 504]
+                if attempt == self.token_refresh_attempts or not retryable:
+                    raise
+                logging.warning(f"Refreshing API auth token failed (attempt {attempt}): {e}")
+                time.sleep(2 ** (attempt - 1))
+        self.__set_token(response.json())
+
+    def __set_token(self, auth_response: dict):
+        self.session.headers.update({"Authorization": f"Bearer {auth_response['accessToken']}"})
+        self.__refresh_token = auth_response["refreshToken"]
+        self.__expires = parse(auth_response["expires"])
+
+    # Background thread - renews the token token_refresh_ahead seconds before it expires
+    def __refresh_periodically(self):
+        while not self.__stop_refresh.is_set():
+            wait_seconds = max(self.__expires_in_seconds() - self.token_refresh_ahead, 0)
+            if self.__stop_refresh.wait(timeout=wait_seconds):
+                return
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.warning(f"Background refresh of API auth token failed: {e}")
+                if self.__stop_refresh.wait(timeout=30):
+                    return
 
     # Returns an integer representing the number of seconds until the current API session key expires
     def __expires_in_seconds(self) -> float:
@@ -75,35 +205,113 @@ class SlopeApi:
         return (self.__expires - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
 
     def __keep_alive(self):
-        # Check this one thread at a time so multiple refreshes don't get triggered. Race conditions on authorization calls = Bad.
-        with self.__lock:
-            # The token expires after 10 minutes. Refresh it if we have less than 5 minutes left
-            if self.__expires_in_seconds() < 300:
-                self.refresh()
+        # The background refresher keeps the token current, so normally this is just a read of the expiry time with no lock
+        if self.__expires is None or self.__expires_in_seconds() >= self.token_min_remaining:
+            return
+
+        # The refresher has fallen behind - refresh here, one thread at a time so multiple refreshes don't get triggered.
+        with self.__auth_lock:
+            if self.__expires_in_seconds() < self.token_min_remaining:
+                self.__refresh()
+
+    # Return the cached metadata value for key, or call loader to retrieve it (and cache it) if it is missing or expired
+    def __get_metadata(self, key: str, loader):
+        with self.__metadata_lock:
+            entry = self.__metadata.get(key)
+            if entry is not None and entry[0] > time.time():
+                return entry[1]
+
+        value = loader()
+        with self.__metadata_lock:
+            self.__metadata[key] = [time.time() + self.metadata_ttl, value]
+            self.__save_metadata_cache()
+        return value
+
+    # Clear cached model metadata so it is retrieved again on next use
+    # If a model_id is given only that model's table structures and templates are cleared (table structure columns are always cleared)
+    def invalidate_metadata(self, model_id: int = None):
+        with self.__metadata_lock:
+            if model_id is None:
+                self.__metadata.clear()
+            else:
+                for key in list(self.__metadata.keys()):
+                    if key.endswith(f"/Model/{model_id}") or key.startswith("TableStructureColumns/"):
+                        del self.__metadata[key]
+            self.__save_metadata_cache(replace=True)
+
+    def __load_metadata_cache(self):
+        if self.metadata_cache_file is None or not os.path.exists(self.metadata_cache_file):
+            return
+        try:
+            with open(self.metadata_cache_file, "r") as file:
+                cached = json.load(file)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not read metadata cache '{self.metadata_cache_file}': {e}")
+            return
+        now = time.time()
+        for key, entry in cached.items():
+            if entry[0] > now and (key not in self.__metadata or self.__metadata[key][0] < entry[0]):
+                self.__metadata[key] = entry
+
+    # Write the metadata cache to disk, merging in entries written by other processes unless replace is set
+    # Must be called while holding the metadata lock
+    def __save_metadata_cache(self, replace: bool = False):
+        if self.metadata_cache_file is None:
+            return
+        if not replace:
+            self.__load_metadata_cache()
+        temp_file = f"{self.metadata_cache_file}.{os.getpid()}.tmp"
+        try:
+            with open(temp_file, "w") as file:
+                json.dump(self.__metadata, file)
+            os.replace(temp_file, self.metadata_cache_file)
+        except OSError as e:
+            logging.warning(f"Could not write metadata cache '{self.metadata_cache_file}': {e}")
 
     # Upload a file from local machine to the SLOPE file manager
+    # The file is streamed from disk and hashed in the same pass. S3 checks the upload against its Content-MD5 header
+    # (see upload_content_md5), and the MD5 is also checked against the ETag returned by S3 when the ETag is an MD5.
     def upload_file(self, filename: str, slope_path: str) -> int:
         self.__keep_alive()
         slope_file_params = {"filePath": slope_path}
         response = self.session.post(f"{self.api_url}/Files/GetUploadUrl", json=slope_file_params)
+        self.__check_response(response)
         upload_url = response.json()["uploadUrl"]
 
         logging.debug(f"Uploading file '{filename}' to '{slope_path}'.")
-        # Calculate the MD5 digest of the file - We will pass this AWS to verify integrity of file upload process
-        md5_digest = self.__file_md5_digest(filename)
+        headers = {}
+        if self.upload_content_md5:
+            # Pass the MD5 digest to AWS so S3 rejects the upload if it was corrupted in transit
+            headers["Content-MD5"] = base64.b64encode(self.__file_md5_digest(filename)).decode("ascii")
+
         # Note - Do not use session here - this is a direct call to s3 and does not use the Slope session auth
-        response = requests.put(upload_url, data=open(filename, "rb"))
+        with open(filename, "rb") as file:
+            reader = _HashingFileReader(file)
+            response = self.transfer_session.put(upload_url, data=reader, headers=headers)
         self.__check_response(response)
 
+        etag = response.headers.get("ETag", "").strip('"')
+        if self.__etag_is_md5(response.headers) and etag != reader.hexdigest():
+            raise IOError(f"Upload of '{filename}' is corrupt. MD5 {reader.hexdigest()} does not match ETag {etag}.")
+
         response = self.session.post(f"{self.api_url}/Files/SaveUpload", json=slope_file_params)
         self.__check_response(response)
         return response.json()["fileId"]
 
+    # A single part S3 upload returns the MD5 of the stored object as its ETag - unless it is encrypted with SSE-KMS or
+    # SSE-C, where the ETag is not the MD5. Multipart ETags contain a '-' and can't be checked this way either.
+    @staticmethod
+    def __etag_is_md5(headers) -> bool:
+        etag = headers.get("ETag", "").strip('"')
+        encryption = headers.get("x-amz-server-side-encryption", "")
+        return (len(etag) == 32 and '-' not in etag and not encryption.startswith("aws:kms")
+                and "x-amz-server-side-encryption-customer-algorithm" not in headers)
+
     @staticmethod
     def __file_md5_digest(filename: str):
         with open(filename, "rb") as f:
             file_hash = hashlib.md5()
-            while chunk := f.read(8192):
+            while chunk := f.read(1048576):
                 file_hash.update(chunk)
         return file_hash.digest()
 
@@ -230,38 +438,84 @@ class SlopeApi:
         return response.json()
     
     # Download results from a single element in a single workbook
-    def download_report(self, workbook_id: str, element_id: str, filename: str, format_type: str, parameters: dict, row_limit=None, offset=None, timeout=900):
-        self.__keep_alive()
-        report_response = self.generate_workbook_report(
-            workbook_id=workbook_id,
-            element_id=element_id,
-            format_type=format_type,
-            parameters=parameters,
-            row_limit=row_limit,
-            offset=offset
-        )
-        generation_id = report_response["generationId"]
-        logging.debug(f"Report generation started with ID: {generation_id}")
+    # chunk_handler (optional) is called with every chunk of bytes as it is written to disk
+    def download_report(self, workbook_id: str, element_id: str, filename: str, format_type: str, parameters: dict, row_limit=None, offset=None, timeout=900, chunk_handler=None, compression: str = None):
+        download_url = self.report_scheduler.submit(workbook_id, element_id, format_type, parameters, row_limit, offset, timeout).result()
+        return self.download_generated_report(download_url, filename, chunk_handler, compression)
 
-        start_time = time.time()
-        while True:
-            status_response = self.get_workbook_report_status(generation_id)
-            if status_response["status"] == "Completed":
-                download_url = status_response["downloadUrl"]
-                break
-            elif status_response["status"] == "Failed":
-                raise Exception(f"Report generation failed: {status_response.get('message', 'Unknown error')}")
-            if time.time() - start_time > timeout:
-                raise TimeoutError(f"Report generation did not complete within {timeout} seconds.")
-            time.sleep(5)
+    # Download a report that has already been generated (e.g. from a URL returned by report_scheduler)
+    def download_generated_report(self, download_url: str, filename: str, chunk_handler=None, compression: str = None) -> dict:
         logging.debug(f"Downloading report from {download_url}")
-        file_response = requests.get(download_url)
-        self.__check_response(file_response)
-        
+        return self.__download_file(download_url, filename, chunk_handler, compression)
+
+    # Stream a file from a presigned URL straight to disk, one chunk at a time, so memory use stays bounded
+    # Uses the pooled transfer session, so connections are reused across downloads and failed requests are retried.
+    # If the connection drops part way through, the download resumes with a Range request from the bytes already
+    # written (or skips them if the server sends the whole file again), so chunk_handler sees every byte exactly once.
+    # Verifies the number of bytes received against Content-Length and the MD5 against the S3 ETag (when available)
+    # compression (optional) - "gzip" or "zstd" to compress the file as it is written. Counts, checks and chunk_handler all see the uncompressed bytes.
+    # Returns a dict with the bytes written and elapsed seconds for the transfer
+    def __download_file(self, url: str, filename: str, chunk_handler=None, compression: str = None) -> dict:
+        start_time = time.time()
+        bytes_written = 0
+        file_hash = hashlib.md5()
+        last_logged = 0
+        expected_length = None
+        etag = ""
+        etag_is_md5 = False
+        content_encoding = None
+
         logging.debug(f"Saving as '{filename}'.")
-        file = open(filename, "wb")
-        file.write(file_response.content)
-        file.close()
+        with open_file(filename, "wb", compression) as file:
+            for attempt in range(1, self.transfer_attempts + 1):
+                headers = {}
+                if bytes_written > 0 and content_encoding is None:
+                    headers["Range"] = f"bytes={bytes_written}-"
+                try:
+                    # Note - Do not use session here - this is a direct call to s3 and does not use the Slope session auth
+                    with self.transfer_session.get(url, stream=True, headers=headers) as response:
+                        self.__check_response(response)
+                        if expected_length is None:
+                            expected_length = response.headers.get("Content-Length")
+                            etag = response.headers.get("ETag", "").strip('"')
+                            etag_is_md5 = self.__etag_is_md5(response.headers)
+                            content_encoding = response.headers.get("Content-Encoding")
+
+                        # Bytes already written that the server is sending again
+                        skip = bytes_written if response.status_code != 206 else 0
+                        for chunk in response.iter_content(chunk_size=self.download_chunk_size):
+                            if skip > 0:
+                                if len(chunk) <= skip:
+                                    skip -= len(chunk)
+                                    continue
+                                chunk = chunk[skip:]
+                                skip = 0
+                            file.write(chunk)
+                            file_hash.update(chunk)
+                            bytes_written += len(chunk)
+                            if chunk_handler is not None:
+                                chunk_handler(chunk)
+                            if bytes_written - last_logged >= self.download_log_interval:
+                                last_logged = bytes_written
+                                elapsed = time.time() - start_time
+                                logging.debug(f"Downloaded {bytes_written / 1048576:,.1f} MB of '{filename}' ({bytes_written / 1048576 / max(elapsed, 1e-6):,.1f} MB/s)")
+                    break
+                except (requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    if attempt == self.transfer_attempts:
+                        raise
+                    logging.warning(f"Download of '{filename}' interrupted after {bytes_written:,} bytes ({e}). Resuming (attempt {attempt + 1} of {self.transfer_attempts}).")
+
+        # Content-Length is the size of the encoded body, so it can only be compared when the body was not compressed in transit
+        if expected_length is not None and content_encoding is None and int(expected_length) != bytes_written:
+            raise IOError(f"Download of '{filename}' was truncated. Expected {expected_length} bytes, received {bytes_written}.")
+
+        # The ETag is the MD5 of the stored object, so it can only be compared when the body was not compressed in transit
+        if etag_is_md5 and content_encoding is None and etag != file_hash.hexdigest():
+            raise IOError(f"Download of '{filename}' is corrupt. MD5 {file_hash.hexdigest()} does not match ETag {etag}.")
+
+        elapsed = time.time() - start_time
+        logging.debug(f"Downloaded {bytes_written:,} bytes to '{filename}' in {elapsed:.1f}s ({bytes_written / 1048576 / max(elapsed, 1e-6):,.1f} MB/s)")
+        return {"bytes": bytes_written, "seconds": elapsed}
 
     def download_and_load_report(self, workbook_id: str, element_id: str, filename: str, format_type: str, parameters: dict) -> pd.DataFrame:
         self.download_report(workbook_id, element_id, filename, format_type, parameters)
@@ -276,74 +530,177 @@ class SlopeApi:
         return data
 
     # Download the contents of a data table with given Data Table ID
-    # Returns an pandas DataFrame object with the contents of the table
-    def get_data_table_by_id(self, data_table_id: int) -> pd.DataFrame:
+    # Returns an pandas DataFrame object with the contents of the table, indexed by the table's index columns
+    # dtype_backend (optional) - "pyarrow" or "numpy_nullable" to return Arrow-backed or nullable pandas columns
+    def get_data_table_by_id(self, data_table_id: int, dtype_backend: str = None) -> pd.DataFrame:
         self.__keep_alive()
         logging.debug(f"Retrieving contents of data table with ID '{data_table_id}'")
-        endpoint_url = f"{self.api_url}/DataTables/Data?DataTableId={data_table_id}"
-        return self.__get_data_table(endpoint_url)
+        return self.__get_data_table(self.__data_table_url_by_id(data_table_id), dtype_backend)
 
     # Download the contents of a data table with given Data Table Name, Version, and Table Structure ID
-    # Returns an pandas DataFrame object with the contents of the table
-    def get_data_table_by_name(self, table_name: str, table_structure_id: int, version: int = None) -> pd.DataFrame:
+    # Returns an pandas DataFrame object with the contents of the table, indexed by the table's index columns
+    def get_data_table_by_name(self, table_name: str, table_structure_id: int, version: int = None, dtype_backend: str = None) -> pd.DataFrame:
         self.__keep_alive()
         version_name = version or "latest"
         logging.debug(f"Retrieving contents of data table with Name '{table_name}' Version '{version_name}' of Table Structure ID '{table_structure_id}'")
+        return self.__get_data_table(self.__data_table_url_by_name(table_name, table_structure_id, version), dtype_backend)
+
+    # Download the contents of a data table with given Data Table ID one page at a time
+    # Yields a pandas DataFrame for each page of the table, so large tables can be processed incrementally
+    def iter_data_table_by_id(self, data_table_id: int, dtype_backend: str = None):
+        self.__keep_alive()
+        logging.debug(f"Retrieving pages of data table with ID '{data_table_id}'")
+        for page in self.__iter_data_table_pages(self.__data_table_url_by_id(data_table_id)):
+            yield SlopeApi.__finalize_data_table(page, dtype_backend)
+
+    # Download the contents of a data table with given Data Table Name, Version, and Table Structure ID one page at a time
+    # Yields a pandas DataFrame for each page of the table, so large tables can be processed incrementally
+    def iter_data_table_by_name(self, table_name: str, table_structure_id: int, version: int = None, dtype_backend: str = None):
+        self.__keep_alive()
+        logging.debug(f"Retrieving pages of data table with Name '{table_name}' Version '{version or 'latest'}' of Table Structure ID '{table_structure_id}'")
+        for page in self.__iter_data_table_pages(self.__data_table_url_by_name(table_name, table_structure_id, version)):
+            yield SlopeApi.__finalize_data_table(page, dtype_backend)
+
+    def __data_table_url_by_id(self, data_table_id: int) -> str:
+        return f"{self.api_url}/DataTables/Data?DataTableId={data_table_id}"
+
+    def __data_table_url_by_name(self, table_name: str, table_structure_id: int, version: int = None) -> str:
         endpoint_url = f"{self.api_url}/DataTables/Data?Name={table_name}&TableStructureId={table_structure_id}"
         if version is not None:
             endpoint_url += f"&Version={version}"
-
-        return self.__get_data_table(endpoint_url)
+        return endpoint_url
 
     # Internal function for getting Data Table contents - Handles pagination of the data contents
-    def __get_data_table(self, url: str) -> pd.DataFrame:
-        response = self.session.get(url)
-        self.__check_response(response)
-        json = response.json()
-        if 'rows' not in json:
-            logging.error("Data Table Files not implemented yet. Empty Data Returns")
+    # All pages are collected first and combined once at the end, so the table is only copied one time
+    def __get_data_table(self, url: str, dtype_backend: str = None) -> pd.DataFrame:
+        pages = list(self.__iter_data_table_pages(url))
+        if len(pages) == 0:
             return pd.DataFrame()
 
-        #data_table = {key:json[key] for key in json.keys() - {'rows', 'offset'}}
-        table = SlopeApi.__parse_data_table_json(json)
-
-        # Check if we got the whole table or if we hit the row limit
-        # If row limit was hit, then offset will be not' 'None' (and contain an integer value)
-        # Keep looping until we get the whole table
-        while json['offset']:
-            logging.debug(f"Retrieving more data from table '{json['name']}' ID '{json['id']}' starting at row {json['offset']}")
-            response = self.session.get(url + f"&Offset={json['offset']}")
-            self.__check_response(response)
-            json = response.json()
-            table = pd.concat([table, SlopeApi.__parse_data_table_json(json)])
-
-        #data_table["data"] = table
+        table = pages[0]
+        if len(pages) > 1:
+            # Each page decides for itself whether a text column is categorical and has its own set of categories
+            # Align the categories when every page is categorical, otherwise combine the column as plain text
+            for name in table.columns:
+                categorical = [isinstance(page[name].dtype, pd.CategoricalDtype) for page in pages]
+                if all(categorical):
+                    categories = table[name].cat.categories
+                    for page in pages[1:]:
+                        categories = categories.union(page[name].cat.categories)
+                    for page in pages:
+                        page[name] = page[name].cat.set_categories(categories)
+                elif any(categorical):
+                    for page in pages:
+                        page[name] = page[name].astype(object)
+            table = pd.concat(pages, ignore_index=True)
+            table.attrs = pages[0].attrs
+
+        return SlopeApi.__finalize_data_table(table, dtype_backend)
+
+    # Internal generator for getting Data Table pages
+    # The request for the next page is sent before the current page is parsed, so parsing overlaps with the network round trip
+    def __iter_data_table_pages(self, url: str):
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="DataTablePrefetch") as executor:
+            json = self.__get_data_table_page(url)
+            if 'rows' not in json:
+                logging.error("Data Table Files not implemented yet. Empty Data Returns")
+                return
+
+            while True:
+                # Check if we got the whole table or if we hit the row limit
+                # If row limit was hit, then offset will be not' 'None' (and contain an integer value)
+                # Keep looping until we get the whole table
+                next_page = None
+                if json['offset']:
+                    logging.debug(f"Retrieving more data from table '{json['name']}' ID '{json['id']}' starting at row {json['offset']}")
+                    next_page = executor.submit(self.__get_data_table_page, url + f"&Offset={json['offset']}")
+
+                yield SlopeApi.__parse_data_table_json(json)
+
+                if next_page is None:
+                    break
+                json = next_page.result()
+
+    def __get_data_table_page(self, url: str) -> dict:
+        self.__keep_alive()
+        response = self.session.get(url)
+        self.__check_response(response)
+        return response.json()
 
+    # Set the index columns on a parsed table and convert to the requested dtype backend
+    @staticmethod
+    def __finalize_data_table(table: pd.DataFrame, dtype_backend: str = None) -> pd.DataFrame:
+        index = table.attrs.get("index_columns", [])
+        if dtype_backend is not None:
+            table = table.convert_dtypes(dtype_backend=dtype_backend)
+        if len(index) > 0:
+            table = table.set_index(index)
         return table
 
     # Internal Method for converting data table contents into pandas DataFrame and setting data properties correctly
+    # Each column is decoded in a single step using the data type from the table's column schema
+    # The index columns are recorded in the frame's attrs and applied once all pages have been combined
     @staticmethod
     def __parse_data_table_json(json) -> pd.DataFrame:
-        columns = []
-        index = []
-        # Get the column names
-        for col in json['columns']:
-            columns.append(col['name'])
-            if col['isIndex']:
-                index.append(col['name'])
-        df = pd.DataFrame.from_records(data=json['rows'], columns=columns)
-        # Convert each column to the correct data type
-        for col in json['columns']:
-            if col['dataType'] == 'Integer' or col['dataType'] == 'Decimal':
-                df[col['name']] = pd.to_numeric(df[col['name']])
-            elif col['dataType'] == 'Boolean':
-                df[col['name']] = df[col['name']].astype(bool)
-            else:
-                df[col['name']] = df[col['name']].astype(str)
+        schema = json['columns']
+        names = [col['name'] for col in schema]
+        rows = json['rows']
+
+        # Transpose the rows into one sequence of values per column
+        if len(rows) == 0:
+            column_values = [[] for _ in schema]
+        elif isinstance(rows[0], dict):
+            column_values = [[row.get(name) for row in rows] for name in names]
+        else:
+            column_values = list(zip(*rows))
+
+        data = {}
+        for col, values in zip(schema, column_values):
+            data[col['name']] = SlopeApi.__decode_data_table_column(col, values)
 
-        df.set_index(index)
+        df = pd.DataFrame(data, columns=names)
+        df.attrs["index_columns"] = [col['name'] for col in schema if col['isIndex']]
         return df
 
+    # Convert the values of a single data table column to a typed array based on its schema dataType
+    @staticmethod
+    def __decode_data_table_column(col: dict, values):
+        if col['dataType'] == 'Integer':
+            # Converted directly so ids above 2**53 are not rounded by a trip through float64
+            try:
+                return np.array(values, dtype=np.int64)
+            except (TypeError, ValueError, OverflowError):
+                # Missing values - decoded as floats below, with NaN for the values that are missing
+                pass
+
+        if col['dataType'] == 'Integer' or col['dataType'] == 'Decimal':
+            try:
+                array = np.array(values, dtype=np.float64)
+            except (TypeError, ValueError):
+                # Only values that are really missing (None or empty) become NaN - anything else that is not a number is an error
+                series = pd.Series(values, dtype=object)
+                series = series.mask(series.isna() | (series == ""))
+                try:
+                    array = pd.to_numeric(series).to_numpy(dtype=np.float64)
+                except (TypeError, ValueError) as e:
+                    raise ValueError(f"Data table column '{col['name']}' has a value that is not a number: {e}") from e
+            if col['dataType'] == 'Integer' and not np.isnan(array).any():
+                return array.astype(np.int64)
+            return array
+
+        if col['dataType'] == 'Boolean':
+            array = np.array(values, dtype=object)
+            if array.size == 0 or all(isinstance(value, bool) for value in values):
+                return array.astype(bool)
+            # Booleans sent as text - compare the text rather than relying on truthiness (where "False" would be True)
+            return np.isin(np.char.lower(array.astype(str)), ['true', '1', 'yes'])
+
+        array = np.array(values, dtype=str)
+        # Index columns and text columns with many repeated values are stored as categoricals to save memory
+        if col['isIndex'] or (array.size > 0 and len(pd.unique(array)) <= array.size // 2):
+            return pd.Categorical(array)
+        return array.astype(object)
+
     # Returns all of the properties set on a given Projection
     def get_projection_details(self, projection_id: int, fields: list[str] = None):
         self.__keep_alive()
@@ -361,6 +718,10 @@ class SlopeApi:
         return self.get_projection_details(projection_id, ["status"])["status"]
     
     def get_table_structure_columns(self, table_structure_id: int) -> list[dict]:
+        return self.__get_metadata(f"TableStructureColumns/{table_structure_id}",
+                                   lambda: self.__get_table_structure_columns(table_structure_id))
+
+    def __get_table_structure_columns(self, table_structure_id: int) -> list[dict]:
         self.__keep_alive()
         logging.debug(f"Retrieving Table Structure columns for ID {table_structure_id}")
         response = self.session.get(f"{self.api_url}/TableStructures/{table_structure_id}/Columns")
@@ -373,7 +734,7 @@ class SlopeApi:
     # False - The projection has completed (possibly unsuccessfully)
     def is_projection_running(self, projection_id) -> bool:
         self.__keep_alive()
-        response = self.session.get(f"{self.api_url}/Projections/{projection_id}")
+        response = self.session.get(f"{self.api_url}/Projections/{projection_id}?fields=isRunning")
         if response.ok:
             return response.json()["isRunning"]
         else:
@@ -413,6 +774,15 @@ class SlopeApi:
         return response.json()
 
     def list_projection_templates(self, model_id: int) -> list[dict]:
+        return self.__get_metadata(f"ProjectionTemplates/Model/{model_id}", lambda: self.__list_projection_templates(model_id))
+
+    # Returns the ID of the projection template with the given name on a model, or None if there isn't one
+    def get_projection_template_id(self, model_id: int, template_name: str) -> int:
+        index = self.__get_metadata(f"ProjectionTemplateIds/Model/{model_id}",
+                                    lambda: {template.get("name"): template.get("id") for template in self.list_projection_templates(model_id)})
+        return index.get(template_name)
+
+    def __list_projection_templates(self, model_id: int) -> list[dict]:
         self.__keep_alive()
         logging.debug(f"Retrieving Projection Templates from model {model_id}")
         url = f"{self.api_url}/Models/{model_id}/ProjectionTemplates"
@@ -426,7 +796,7 @@ class SlopeApi:
         # Keep looping until we get the whole table
         while 'offset' in json and json['offset']:
             logging.debug(f"Retrieving more templates for model {model_id} starting at row {json['offset']}")
-            response = self.session.get(url + f"&Offset={json['offset']}")
+            response = self.session.get(url + f"?Offset={json['offset']}")
             self.__check_response(response)
             json = response.json()
             templates = templates + json["items"]
@@ -435,6 +805,15 @@ class SlopeApi:
     
     # Returns a list of all table structures that exist on a given Model ID
     def list_table_structures(self, model_id: int) -> list[dict]:
+        return self.__get_metadata(f"TableStructures/Model/{model_id}", lambda: self.__list_table_structures(model_id))
+
+    # Returns the ID of the table structure with the given name on a model, or None if there isn't one
+    def get_table_structure_id(self, model_id: int, table_structure_name: str) -> int:
+        index = self.__get_metadata(f"TableStructureIds/Model/{model_id}",
+                                    lambda: {table.get("name"): table.get("id") for table in self.list_table_structures(model_id)})
+        return index.get(table_structure_name)
+
+    def __list_table_structures(self, model_id: int) -> list[dict]:
         self.__keep_alive()
         logging.debug(f"Retrieving all Table Structures from mode {model_id}")
         response = self.session.get(f"{self.api_url}/TableStructures/List/{model_id}")
@@ -486,9 +865,7 @@ class SlopeApi:
         response = self.session.patch(f"{self.api_url}/Projections/{projection_id}", json=projection_update_parameters)
         self.__check_response(response)
 
-    # Wait until a projection has completed running. Periodically check for updates until is is finished.
-    def wait_for_completion(self, projection_id):
-        while self.is_projection_running(projection_id):
-            status = self.get_projection_status(projection_id)
-            logging.info(f"Waiting for Projection ID {projection_id} to finish. Current status: {status}")
-            time.sleep(15)  # Check once every 15 seconds if it is done
+    # Wait until a projection has completed running. Returns the final status details of the projection.
+    # Status checks are shared with every other projection being waited on through this API instance (see ProjectionWatcher)
+    def wait_for_completion(self, projection_id, expected_runtime: float = None) -> dict:
+        return self.projection_watcher.wait(projection_id, expected_runtime)